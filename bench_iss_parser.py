@@ -0,0 +1,139 @@
+# bench_iss_parser.py
+"""
+Сравнение старого разбора bondization.json (словарь на строку, strptime при фильтрации
+и сортировке) с общим разборщиком bonds_get.iss_parser.
+
+    python bench_iss_parser.py                  # синтетическая длинная амортизируемая облигация
+    python bench_iss_parser.py payload.json ... # сохранённые ответы MOEX
+"""
+import json
+import sys
+import timeit
+from datetime import date, datetime, timedelta
+
+from bonds_get.iss_parser import parse_bondization
+
+REPEAT = 5
+NUMBER = 200
+
+
+def synthetic_payload(years: int = 30, per_year: int = 12) -> dict:
+    """Ответ в формате ISS для облигации с ежемесячными купонами и амортизациями."""
+    start = date(2015, 1, 15)
+    periods = years * per_year
+    step = timedelta(days=365 // per_year)
+    coupons, amortizations = [], []
+    for i in range(periods):
+        day = (start + step * i).isoformat()
+        coupons.append(["RU000TEST001", "Тестовая облигация", "2015-01-15", day, 1000.0, "SUR",
+                        round(8.5 - i * 0.001, 3), 6.99, 1000 - i, "RUB"])
+        amortizations.append(["RU000TEST001", "Тестовая облигация", "2015-01-15", day, 1000.0, "SUR",
+                              0.28, 2.78, "amortization" if i < periods - 1 else "maturity", "RUB"])
+    offers = [
+        ["RU000TEST001", "Тестовая облигация", (start + timedelta(days=365 * y)).isoformat(), 100.0,
+         "Оферта" if y % 2 else "Оферта отменена", "RUB"]
+        for y in range(1, years, 5)
+    ]
+    return {
+        "coupons": {"columns": ["isin", "name", "issuedate", "coupondate", "initialfacevalue", "faceunit",
+                                "value", "valueprc", "value_rub", "currency"], "data": coupons},
+        "amortizations": {"columns": ["isin", "name", "issuedate", "amortdate", "facevalue", "faceunit",
+                                      "valueprc", "value", "data_source", "currency"], "data": amortizations},
+        "offers": {"columns": ["isin", "name", "offerdate", "price", "offertype", "currency"], "data": offers},
+    }
+
+
+def legacy_parse(data: dict) -> dict:
+    """Прежний подход: поиск индексов, словарь на строку, повторные strptime."""
+    today = datetime.utcnow().date()
+    result = {"coupons": [], "amortizations": [], "offers": [], "maturity_date": None, "next_offer_date": None,
+              "next_coupon_date": None, "next_amortization_date": None}
+
+    meta = data["coupons"]["columns"]
+    idx_date, idx_value, idx_percent = meta.index("coupondate"), meta.index("value"), meta.index("valueprc")
+    for row in data["coupons"]["data"]:
+        if row[idx_date]:
+            result["coupons"].append({"couponDate": str(row[idx_date]), "couponValue": row[idx_value] or 0,
+                                      "couponPercent": row[idx_percent] or 0, "type": "COUPON"})
+    future = [c for c in result["coupons"] if datetime.strptime(c["couponDate"], "%Y-%m-%d").date() >= today]
+    future.sort(key=lambda c: datetime.strptime(c["couponDate"], "%Y-%m-%d").date())
+    if future:
+        result["next_coupon_date"] = datetime.strptime(future[0]["couponDate"], "%Y-%m-%d").date()
+
+    meta = data["amortizations"]["columns"]
+    idx_source, idx_date, idx_value = meta.index("data_source"), meta.index("amortdate"), meta.index("value")
+    dates = []
+    for row in data["amortizations"]["data"]:
+        if row[idx_date]:
+            result["amortizations"].append({"amortDate": str(row[idx_date]), "amortValue": row[idx_value] or 0,
+                                            "dataSource": row[idx_source] or "", "type": "AMORTIZATION"})
+            dates.append(row[idx_date])
+    upcoming = [
+        {**a, "parsed_date": datetime.strptime(a["amortDate"], "%Y-%m-%d").date()}
+        for a in result["amortizations"]
+        if a["dataSource"] == "amortization" and datetime.strptime(a["amortDate"], "%Y-%m-%d").date() >= today
+    ]
+    upcoming.sort(key=lambda a: a["parsed_date"])
+    if upcoming:
+        result["next_amortization_date"] = upcoming[0]["parsed_date"]
+    if dates:
+        result["maturity_date"] = max(datetime.strptime(str(d), "%Y-%m-%d").date() for d in dates)
+
+    meta = data["offers"]["columns"]
+    idx_date, idx_type = meta.index("offerdate"), meta.index("offertype")
+    offers = []
+    for row in data["offers"]["data"]:
+        if "отмен" in row[idx_type].lower() or not row[idx_date]:
+            continue
+        offer_date = datetime.strptime(row[idx_date], "%Y-%m-%d").date()
+        if offer_date > today:
+            offers.append(offer_date)
+            result["offers"].append({"offer_date": row[idx_date], "type": row[idx_type], "status": "UPCOMING"})
+    if offers:
+        result["next_offer_date"] = min(offers)
+    return result
+
+
+def table_driven_parse(data: dict) -> dict:
+    """Новый путь: один проход по строкам, та же выборка ближайших событий."""
+    today = datetime.utcnow().date()
+    parsed = parse_bondization(data)
+    future = sorted((c for c in parsed.coupons if c.coupon_date >= today), key=lambda c: c.coupon_date)
+    upcoming = sorted(
+        (a for a in parsed.amortizations if a.data_source == "amortization" and a.amort_date >= today),
+        key=lambda a: a.amort_date,
+    )
+    offers = [o for o in parsed.offers if o.offer_date > today and "отмен" not in o.offer_type.lower()]
+    return {
+        "coupons": parsed.coupons,
+        "amortizations": parsed.amortizations,
+        "offers": offers,
+        "maturity_date": max((a.amort_date for a in parsed.amortizations), default=None),
+        "next_offer_date": min((o.offer_date for o in offers), default=None),
+        "next_coupon_date": future[0].coupon_date if future else None,
+        "next_amortization_date": upcoming[0].amort_date if upcoming else None,
+    }
+
+
+# Ближайшие события, которые оба пути должны определить одинаково
+COMPARED_FIELDS = ("maturity_date", "next_offer_date", "next_coupon_date", "next_amortization_date")
+
+
+def bench(name: str, payload: dict):
+    rows = sum(len(payload.get(t, {}).get("data", [])) for t in ("coupons", "amortizations", "offers"))
+    expected, actual = legacy_parse(payload), table_driven_parse(payload)
+    for field in COMPARED_FIELDS:
+        assert expected[field] == actual[field], f"{name}: {field} {expected[field]} != {actual[field]}"
+    legacy = min(timeit.repeat(lambda: legacy_parse(payload), repeat=REPEAT, number=NUMBER)) / NUMBER
+    fast = min(timeit.repeat(lambda: table_driven_parse(payload), repeat=REPEAT, number=NUMBER)) / NUMBER
+    print(f"{name}: {rows} строк | старый {legacy * 1e3:.3f} мс | новый {fast * 1e3:.3f} мс | x{legacy / fast:.1f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        for path in sys.argv[1:]:
+            with open(path, encoding="utf-8") as f:
+                bench(path, json.load(f))
+    else:
+        bench("синтетика 30 лет, ежемесячно", synthetic_payload())
+        bench("синтетика 10 лет, ежеквартально", synthetic_payload(years=10, per_year=4))
@@ -0,0 +1,92 @@
+# bonds_get/bond_events.py
+
+import logging
+from datetime import date
+
+from sqlalchemy import select, delete, literal, union_all, Float
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bonds_get.iss_parser import iso_date
+from database.db import BondEvent, BondsDatabase
+
+logger = logging.getLogger("bond_events")
+
+
+def events_from_bondization(data: dict, today: date) -> list[dict]:
+    """Будущие события из ответа get_bondization_data_from_moex в виде строк bond_events."""
+    isin = data["isin"]
+    events = []
+
+    for c in data.get("coupons", []):
+        if c.coupon_date >= today:
+            events.append({"isin": isin, "event_type": "coupon", "event_date": c.coupon_date,
+                           "amount": c.value or None})
+
+    for a in data.get("amortizations", []):
+        if a.data_source == "amortization" and a.amort_date >= today:
+            events.append({"isin": isin, "event_type": "amortization", "event_date": a.amort_date,
+                           "amount": a.value or 0.0})
+
+    for o in data.get("offers", []):
+        if o.offer_date >= today:
+            events.append({"isin": isin, "event_type": "offer", "event_date": o.offer_date, "amount": None})
+
+    maturity_date = iso_date(data.get("maturity_date"))
+    if maturity_date and maturity_date >= today:
+        events.append({"isin": isin, "event_type": "maturity", "event_date": maturity_date, "amount": None})
+
+    # Уникальность по (тип, дата): повторы в ответе MOEX схлопываются
+    unique = {(e["event_type"], e["event_date"]): e for e in events}
+    return list(unique.values())
+
+
+async def replace_events(session: AsyncSession, events_by_isin: dict[str, list[dict]], today: date,
+                         chunk_size: int = 1000):
+    """
+    Заменяет будущие события пачки облигаций: DELETE ... WHERE isin IN (...) и
+    одна пакетная вставка. Коммит делает вызывающий код.
+    """
+    isins = list(events_by_isin)
+    for i in range(0, len(isins), chunk_size):
+        await session.execute(
+            delete(BondEvent).where(BondEvent.isin.in_(isins[i:i + chunk_size]), BondEvent.event_date >= today)
+        )
+    rows = [event for events in events_by_isin.values() for event in events]
+    if rows:
+        await session.execute(pg_insert(BondEvent).on_conflict_do_nothing(), rows)
+    logger.debug(f"📅 Сохранено {len(rows)} будущих событий для {len(isins)} облигаций")
+
+
+async def replace_bond_events(session: AsyncSession, isin: str, events: list[dict], today: date):
+    """Заменяет будущие события облигации. Коммит делает вызывающий код."""
+    await replace_events(session, {isin: events}, today)
+
+
+async def refresh_events_from_bonds(session: AsyncSession, today: date):
+    """
+    Одним INSERT ... SELECT переносит ближайшие будущие даты из bonds_database в bond_events,
+    чтобы события были и у облигаций, которые в эту ночь не запрашивались на MOEX.
+    Прошедшие события удаляются в той же транзакции, иначе таблица растёт каждую ночь.
+    Коммит делает вызывающий код.
+    """
+    result = await session.execute(delete(BondEvent).where(BondEvent.event_date < today))
+    logger.info(f"🧹 Удалено прошедших событий: {result.rowcount}")
+
+    no_amount = literal(None, Float)
+    sources = [
+        ("coupon", BondsDatabase.next_coupon_date, BondsDatabase.next_coupon_value),
+        ("amortization", BondsDatabase.amortization_date, BondsDatabase.amortization_value),
+        ("offer", BondsDatabase.offer_date, no_amount),
+        ("maturity", BondsDatabase.maturity_date, no_amount),
+    ]
+    rows = union_all(*(
+        select(BondsDatabase.isin, literal(event_type), date_col, amount_col).where(date_col >= today)
+        for event_type, date_col, amount_col in sources
+    ))
+    stmt = pg_insert(BondEvent).from_select(["isin", "event_type", "event_date", "amount"], rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["isin", "event_type", "event_date"],
+        set_={"amount": stmt.excluded.amount},
+    )
+    await session.execute(stmt)
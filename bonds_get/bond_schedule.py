@@ -0,0 +1,163 @@
+# bonds_get/bond_schedule.py
+
+import logging
+from datetime import datetime, date, timedelta
+
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bonds_get.iss_parser import Coupon, Amortization, Offer
+from config import SCHEDULE_TTL_DAYS
+from database.db import BondsDatabase, BondCoupon, BondAmortization, BondOffer
+
+logger = logging.getLogger("bond_schedule")
+
+# Ограничение размера IN (...) при загрузке графиков по списку ISIN
+ISIN_CHUNK_SIZE = 1000
+
+
+def schedule_rows(isin: str, data: dict) -> tuple[list[dict], list[dict], list[dict]]:
+    """Строки bond_coupons, bond_amortizations и bond_offers из ответа get_bondization_data_from_moex."""
+    coupons = {
+        c.coupon_date: {"isin": isin, "coupon_date": c.coupon_date, "value": c.value, "percent": c.percent}
+        for c in data.get("coupons", [])
+    }
+    amortizations = {
+        (a.amort_date, a.data_source): {"isin": isin, "amort_date": a.amort_date, "value": a.value,
+                                        "data_source": a.data_source}
+        for a in data.get("amortizations", [])
+    }
+    offers = {
+        (o.offer_date, o.offer_type): {"isin": isin, "offer_date": o.offer_date, "offer_type": o.offer_type}
+        for o in data.get("offers", [])
+    }
+    return list(coupons.values()), list(amortizations.values()), list(offers.values())
+
+
+async def store_schedules(session: AsyncSession, schedules: dict[str, dict]):
+    """
+    Заменяет сохранённые графики пачки облигаций: один DELETE ... WHERE isin IN (...)
+    и одна пакетная вставка на таблицу. schedule_fetched_at и payload_hash
+    обновляет вызывающий код вместе с остальными полями, коммит — тоже.
+    """
+    if not schedules:
+        return
+    isins = list(schedules)
+    rows_by_model = {BondCoupon: [], BondAmortization: [], BondOffer: []}
+    for isin, data in schedules.items():
+        coupons, amortizations, offers = schedule_rows(isin, data)
+        rows_by_model[BondCoupon] += coupons
+        rows_by_model[BondAmortization] += amortizations
+        rows_by_model[BondOffer] += offers
+
+    for model, rows in rows_by_model.items():
+        for i in range(0, len(isins), ISIN_CHUNK_SIZE):
+            await session.execute(delete(model).where(model.isin.in_(isins[i:i + ISIN_CHUNK_SIZE])))
+        if rows:
+            await session.execute(pg_insert(model).on_conflict_do_nothing(), rows)
+    logger.debug(f"💾 Графики сохранены: {len(isins)} облигаций, {len(rows_by_model[BondCoupon])} купонов")
+
+
+async def store_schedule(session: AsyncSession, isin: str, data: dict):
+    """Заменяет сохранённый график одной облигации (см. store_schedules)."""
+    await store_schedules(session, {isin: data})
+
+
+async def last_coupon_dates(session: AsyncSession, isins: list[str]) -> dict[str, date]:
+    """Дата последнего сохранённого купона по каждой облигации."""
+    result = {}
+    for i in range(0, len(isins), ISIN_CHUNK_SIZE):
+        rows = await session.execute(
+            select(BondCoupon.isin, func.max(BondCoupon.coupon_date))
+            .where(BondCoupon.isin.in_(isins[i:i + ISIN_CHUNK_SIZE]))
+            .group_by(BondCoupon.isin)
+        )
+        result.update({isin: last_date for isin, last_date in rows})
+    return result
+
+
+def schedule_is_stale(bond: BondsDatabase, last_coupon: date | None, today: date) -> bool:
+    """
+    График нужно перезапросить, если его нет, истёк SCHEDULE_TTL_DAYS
+    или купоны закончились, а бумага ещё не погашена.
+    Без payload_hash график ещё не был получен.
+    """
+    if bond.schedule_fetched_at is None or bond.payload_hash is None:
+        return True
+    if bond.schedule_fetched_at < datetime.utcnow() - timedelta(days=SCHEDULE_TTL_DAYS):
+        return True
+    not_matured = bond.maturity_date is None or bond.maturity_date > today
+    return last_coupon is not None and last_coupon < today and not_matured
+
+
+async def load_schedules(session: AsyncSession, isins: list[str], today: date) -> dict[str, dict]:
+    """
+    Загружает сохранённые графики и возвращает их в формате get_bondization_data_from_moex,
+    чтобы ближайшие события считались локально, без запроса к MOEX.
+    """
+    schedules = {
+        isin: {"isin": isin, "coupons": [], "amortizations": [], "offers": [],
+               "maturity_date": None, "next_offer_date": None}
+        for isin in isins
+    }
+
+    for i in range(0, len(isins), ISIN_CHUNK_SIZE):
+        chunk = isins[i:i + ISIN_CHUNK_SIZE]
+
+        for isin, coupon_date, value, percent in await session.execute(
+                select(BondCoupon.isin, BondCoupon.coupon_date, BondCoupon.value, BondCoupon.percent)
+                .where(BondCoupon.isin.in_(chunk))
+        ):
+            schedules[isin]["coupons"].append(Coupon(coupon_date, value, percent))
+
+        for isin, amort_date, value, source in await session.execute(
+                select(BondAmortization.isin, BondAmortization.amort_date, BondAmortization.value,
+                       BondAmortization.data_source)
+                .where(BondAmortization.isin.in_(chunk))
+        ):
+            schedule = schedules[isin]
+            schedule["amortizations"].append(Amortization(amort_date, value, source))
+            if schedule["maturity_date"] is None or amort_date > schedule["maturity_date"]:
+                schedule["maturity_date"] = amort_date
+
+        for isin, offer_date, offer_type in await session.execute(
+                select(BondOffer.isin, BondOffer.offer_date, BondOffer.offer_type)
+                .where(BondOffer.isin.in_(chunk), BondOffer.offer_date > today)
+        ):
+            schedule = schedules[isin]
+            schedule["offers"].append(Offer(offer_date, offer_type))
+            if schedule["next_offer_date"] is None or offer_date < schedule["next_offer_date"]:
+                schedule["next_offer_date"] = offer_date
+
+    return schedules
+
+
+def compute_bond_update(bond: BondsDatabase, data: dict, today: date) -> dict:
+    """Возвращает только изменившиеся поля облигации по данным MOEX (аналогично bond_update)"""
+    values = {}
+
+    # Основные поля
+    if data.get("maturity_date"):
+        values["maturity_date"] = data["maturity_date"]
+    if data.get("next_offer_date"):
+        values["offer_date"] = data["next_offer_date"]
+
+    # Ближайший купон
+    upcoming_coupons = [c for c in data.get("coupons", []) if c.coupon_date > today]
+    if upcoming_coupons:
+        next_coupon = min(upcoming_coupons, key=lambda c: c.coupon_date)
+        values["next_coupon_date"] = next_coupon.coupon_date
+        values["next_coupon_value"] = next_coupon.value or 0.0
+
+    # Ближайшая амортизация
+    upcoming_amorts = [
+        a for a in data.get("amortizations", [])
+        if a.data_source == "amortization" and a.amort_date >= today
+    ]
+    if upcoming_amorts:
+        next_amort = min(upcoming_amorts, key=lambda a: a.amort_date)
+        values["amortization_date"] = next_amort.amort_date
+        values["amortization_value"] = next_amort.value or 0.0
+
+    return {field: value for field, value in values.items() if getattr(bond, field) != value}
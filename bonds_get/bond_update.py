@@ -2,10 +2,12 @@
 
 from datetime import datetime
 import logging
-from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from bonds_get.moex_lookup import get_bondization_data_from_moex
+from bonds_get.bond_events import events_from_bondization, replace_bond_events
+from bonds_get.bond_schedule import store_schedule, compute_bond_update
 from database.db import BondsDatabase
+from database.portfolio import bump_bond_holders
 
 logger = logging.getLogger("bond_update")
 
@@ -20,73 +22,31 @@ async def get_next_coupon(
 
     try:
         data = await get_bondization_data_from_moex(isin)
-        coupons = data.get("coupons", [])
-        amortizations = data.get("amortizations", [])
-        maturity_date = data.get("maturity_date")
-        next_offer_date = data.get("next_offer_date")
-
-        # Обновление основных данных
-        updates_made = False
-        if maturity_date:
-            bond.maturity_date = maturity_date
-            updates_made = True
-            logger.debug(f"📅 Дата погашения обновлена: {bond.maturity_date}")
-
-        if next_offer_date:
-            bond.offer_date = next_offer_date
-            updates_made = True
-            logger.debug(f"📆 Дата оферты обновлена: {bond.offer_date}")
-
-        if updates_made:
-            await session.commit()  # Асинхронный коммит
-
-        # Обработка купонов
-        upcoming = []
-        for c in coupons:
-            if raw_date := c.get("couponDate"):
-                try:
-                    parsed_date = datetime.strptime(raw_date, "%Y-%m-%d").date()
-                    if parsed_date >= today:
-                        upcoming.append({**c, "parsed_date": parsed_date})
-                except ValueError:
-                    logger.warning(f"⚠️ Невалидная дата купона: {raw_date} для {isin}")
-
-        if upcoming:
-            upcoming.sort(key=lambda x: x["parsed_date"])
-            first = upcoming[0]
-            bond.next_coupon_date = first["parsed_date"]
-            bond.next_coupon_value = float(first["couponValue"]) if first.get("couponValue") else None
-            logger.info(f"✅ Обновлён купон: {bond.next_coupon_date}, {bond.next_coupon_value}")
-            await session.commit()
-
-        # Обработка амортизаций
-        upcoming_amortizations = [
-            {**a, "parsed_date": datetime.strptime(a["amortDate"], "%Y-%m-%d").date()}
-            for a in amortizations
-            if a.get("dataSource") == "amortization"
-               and a.get("amortDate")
-               and datetime.strptime(a["amortDate"], "%Y-%m-%d").date() >= today
-        ]
-
-        if upcoming_amortizations:
-            upcoming_amortizations.sort(key=lambda x: x["parsed_date"])
-            first_amort = upcoming_amortizations[0]
-            bond.amortization_date = first_amort["parsed_date"]
-            bond.amortization_value = float(first_amort.get("amortValue") or 0)
-            logger.info(f"✅ Обновлена амортизация: {bond.amortization_date}, {bond.amortization_value}")
-            await session.commit()
-
-        # Получение обновлённой записи
-        result = await session.execute(
-            select(BondsDatabase).filter_by(isin=isin)  # Асинхронный запрос
-        )
-        updated_bond = result.scalars().first()
-
+        if data.get("payload_hash") is None:
+            logger.warning(f"⚠️ Нет данных MOEX для {isin}, облигация не обновлена")
+            return
+
+        changes = compute_bond_update(bond, data, today)
+        for field, value in changes.items():
+            setattr(bond, field, value)
+            logger.debug(f"📅 {isin}: {field} = {value}")
+
+        # График и события переписываются, только если ответ MOEX изменился
+        if data["payload_hash"] != bond.payload_hash:
+            await store_schedule(session, isin, data)
+            await replace_bond_events(session, isin, events_from_bondization(data, today), today)
+            bond.payload_hash = data["payload_hash"]
+        bond.schedule_fetched_at = datetime.utcnow()
+
+        await session.commit()
+        # Облигация может быть в портфелях других пользователей
+        if changes:
+            bump_bond_holders(isin)
         logger.debug(
             f"Обновленные данные: "
-            f"погашение={updated_bond.maturity_date}, "
-            f"оферта={updated_bond.offer_date}, "
-            f"купон={updated_bond.next_coupon_date}"
+            f"погашение={bond.maturity_date}, "
+            f"оферта={bond.offer_date}, "
+            f"купон={bond.next_coupon_date}"
         )
 
     except Exception as e:
@@ -2,23 +2,27 @@ import asyncio
 
 import httpx
 
+from bonds_get.moex_client import moex_get_json
+from bonds_get.moex_policy import MoexUnavailable
 
-async def is_bond(isin: str) -> bool:
-    """Асинхронно проверяет, является ли бумага облигацией по параметру GROUP."""
-    url = f"https://iss.moex.com/iss/securities/{isin}.json"
 
+async def is_bond(isin: str) -> bool:
+    """
+    Асинхронно проверяет, является ли бумага облигацией по параметру GROUP.
+    Если MOEX недоступна (и в кэше нет ответа), поднимает MoexUnavailable —
+    это не то же самое, что «не облигация».
+    """
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            data = response.json()
+        data = await moex_get_json(f"/securities/{isin}.json")
 
-            # Ищем параметр GROUP со значением stock_bonds
-            for item in data.get('description', {}).get('data', []):
-                if len(item) >= 3 and item[0] == 'GROUP' and item[2] == 'stock_bonds':
-                    return True
-            return False
+        # Ищем параметр GROUP со значением stock_bonds
+        for item in data.get('description', {}).get('data', []):
+            if len(item) >= 3 and item[0] == 'GROUP' and item[2] == 'stock_bonds':
+                return True
+        return False
 
+    except MoexUnavailable:
+        raise
     except httpx.HTTPStatusError as e:
         print(f"HTTP error: {e}")
         return False
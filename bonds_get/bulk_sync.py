@@ -0,0 +1,193 @@
+# bonds_get/bulk_sync.py
+
+import logging
+from datetime import date, datetime
+
+from sqlalchemy import delete, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from bonds_get.moex_client import moex_get_json_resuming
+from database.db import get_session, BondsDatabase, BondEvent
+
+logger = logging.getLogger("bulk_sync")
+
+# Все облигации рынка одним набором запросов (по строке на режим торгов)
+MARKET_SECURITIES_PATH = "/engines/stock/markets/bonds/securities.json"
+MARKET_COLUMNS = (
+    "SECID", "BOARDID", "SHORTNAME", "SECNAME", "ISIN",
+    "NEXTCOUPON", "COUPONVALUE", "MATDATE", "OFFERDATE", "PUTOPTIONDATE",
+)
+
+# Поле bonds_database -> тип события в bond_events
+EVENT_TYPE_BY_FIELD = {
+    "next_coupon_date": "coupon",
+    "offer_date": "offer",
+    "maturity_date": "maturity",
+}
+
+
+def _market_date(raw) -> date | None:
+    # MOEX отдаёт пустые даты как "0000-00-00"
+    if not raw or str(raw).startswith("0000"):
+        return None
+    try:
+        return date.fromisoformat(str(raw))
+    except ValueError:
+        return None
+
+
+async def fetch_market_bonds() -> dict[str, dict]:
+    """
+    Загружает таблицу securities рынка облигаций постранично.
+    Возвращает {isin: строка}, по одной строке на ISIN.
+    """
+    market = {}
+    start = 0
+    while True:
+        data = await moex_get_json_resuming(MARKET_SECURITIES_PATH, params={
+            "iss.meta": "off",
+            "iss.only": "securities",
+            "securities.columns": ",".join(MARKET_COLUMNS),
+            "start": start,
+        })
+        block = data.get("securities", {})
+        columns = block.get("columns", [])
+        rows = block.get("data", [])
+
+        new_isins = 0
+        for row in rows:
+            record = dict(zip(columns, row))
+            isin = record.get("ISIN")
+            if not isin:
+                continue
+            known = market.get(isin)
+            if known is None:
+                new_isins += 1
+            # Бумага торгуется в нескольких режимах — предпочитаем строку с датой купона
+            if known is None or (_market_date(record.get("NEXTCOUPON")) and not _market_date(known.get("NEXTCOUPON"))):
+                market[isin] = record
+
+        # Конец выдачи: пустая страница или повтор уже полученных бумаг
+        if not rows or not new_isins:
+            break
+        start += len(rows)
+
+    logger.info(f"📦 Рыночная таблица MOEX: {len(market)} облигаций")
+    return market
+
+
+def market_values(record: dict, today: date) -> dict:
+    """Поля bonds_database из строки рыночной таблицы."""
+    values = {}
+
+    next_coupon = _market_date(record.get("NEXTCOUPON"))
+    if next_coupon and next_coupon > today:
+        values["next_coupon_date"] = next_coupon
+        if record.get("COUPONVALUE") is not None:
+            values["next_coupon_value"] = float(record["COUPONVALUE"])
+
+    maturity = _market_date(record.get("MATDATE"))
+    if maturity:
+        values["maturity_date"] = maturity
+
+    offers = [d for d in (_market_date(record.get("OFFERDATE")), _market_date(record.get("PUTOPTIONDATE")))
+              if d and d > today]
+    if offers:
+        values["offer_date"] = min(offers)
+
+    return values
+
+
+def needs_schedule(bond: BondsDatabase, record: dict | None) -> bool:
+    """
+    Рыночная таблица не содержит графика амортизаций, поэтому по графику
+    обновляются амортизируемые бумаги, бумаги, которых нет в рыночной таблице,
+    и бумаги, график которых ещё ни разу не был получен (payload_hash пуст):
+    только bondization показывает, есть ли у бумаги амортизация.
+    Повторно bondization запрашивается по SCHEDULE_TTL_DAYS, с ограничением параллельности сверки.
+    """
+    return record is None or bond.amortization_date is not None or bond.payload_hash is None
+
+
+async def load_market_table() -> dict[str, dict] | None:
+    """Рыночная таблица для всей сверки; None — не загрузилась, сверка пойдёт по ISIN."""
+    try:
+        return await fetch_market_bonds()
+    except Exception as e:
+        logger.error(f"❌ Не удалось загрузить рыночную таблицу MOEX, синхронизация по ISIN: {e}")
+        return None
+
+
+async def sync_from_market_tables(bonds: list, market: dict[str, dict], stats: dict, today: date,
+                                  batch_size: int) -> list:
+    """
+    Обновляет облигации (строки с колонками BondsDatabase) по рыночной таблице MOEX пакетным upsert.
+    Возвращает облигации, которые нужно обновить по графику (локально или запросом по ISIN).
+    """
+    fallback = []
+    rows = []
+    changed_events = {event_type: [] for event_type in EVENT_TYPE_BY_FIELD.values()}
+    now = datetime.utcnow()
+
+    for bond in bonds:
+        record = market.get(bond.isin)
+        if needs_schedule(bond, record):
+            fallback.append(bond)
+            continue
+
+        values = market_values(record, today)
+        if not bond.name and (name := record.get("SECNAME") or record.get("SHORTNAME")):
+            values["name"] = name
+        changes = {field: value for field, value in values.items() if getattr(bond, field) != value}
+        if not changes:
+            stats["unchanged"] += 1
+            continue
+
+        # Старая дата заменена новой: удаляется только это событие, остальной график не трогаем
+        for field, event_type in EVENT_TYPE_BY_FIELD.items():
+            old_date = getattr(bond, field)
+            if field in changes and old_date is not None and old_date >= today:
+                changed_events[event_type].append((bond.isin, old_date))
+
+        # Строки multi-VALUES должны иметь одинаковый набор колонок
+        rows.append({
+            "isin": bond.isin,
+            "name": values.get("name", bond.name),
+            "next_coupon_date": values.get("next_coupon_date", bond.next_coupon_date),
+            "next_coupon_value": values.get("next_coupon_value", bond.next_coupon_value),
+            "maturity_date": values.get("maturity_date", bond.maturity_date),
+            "offer_date": values.get("offer_date", bond.offer_date),
+            "last_updated": now,
+        })
+
+    for i in range(0, len(rows), batch_size):
+        chunk = rows[i:i + batch_size]
+        chunk_isins = {row["isin"] for row in chunk}
+        try:
+            async with get_session() as session:
+                stmt = pg_insert(BondsDatabase).values(chunk)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["isin"],
+                    set_={column: stmt.excluded[column] for column in chunk[0] if column != "isin"},
+                )
+                await session.execute(stmt)
+
+                # Заменённые события удаляются, новые даты переносятся из bonds_database в конце сверки.
+                # Прочие будущие события из bondization (следующие купоны, оферты) остаются
+                for event_type, replaced in changed_events.items():
+                    stale = [(isin, old_date) for isin, old_date in replaced if isin in chunk_isins]
+                    if stale:
+                        await session.execute(
+                            delete(BondEvent).where(
+                                BondEvent.event_type == event_type,
+                                tuple_(BondEvent.isin, BondEvent.event_date).in_(stale),
+                            )
+                        )
+                await session.commit()
+            stats["updated"] += len(chunk)
+        except Exception as e:
+            logger.error(f"❌ Ошибка пакетной записи {len(chunk)} облигаций: {e}", exc_info=True)
+            stats["failed"] += len(chunk)
+
+    logger.info(f"📊 Рыночная таблица: обновлено {len(rows)}, по ISIN осталось {len(fallback)}")
+    return fallback
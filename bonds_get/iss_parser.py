@@ -0,0 +1,111 @@
+# bonds_get/iss_parser.py
+
+import logging
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Callable
+
+logger = logging.getLogger("iss_parser")
+
+
+@dataclass(slots=True)
+class Coupon:
+    coupon_date: date
+    value: float | None
+    percent: float | None
+
+
+@dataclass(slots=True)
+class Amortization:
+    amort_date: date
+    value: float | None
+    data_source: str
+
+
+@dataclass(slots=True)
+class Offer:
+    offer_date: date
+    offer_type: str
+
+
+@dataclass(slots=True)
+class Bondization:
+    """Разобранные таблицы bondization.json."""
+    coupons: list[Coupon] = field(default_factory=list)
+    amortizations: list[Amortization] = field(default_factory=list)
+    offers: list[Offer] = field(default_factory=list)
+
+
+def iso_date(raw) -> date | None:
+    """Дата ISS ("YYYY-MM-DD"). Пустые и "0000-00-00" даты -> None."""
+    if not raw:
+        return None
+    if isinstance(raw, date):
+        return raw
+    try:
+        return date.fromisoformat(raw)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_float(raw) -> float | None:
+    if raw is None or raw == "":
+        return None
+    try:
+        return float(raw)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_str(raw) -> str:
+    return str(raw) if raw is not None else ""
+
+
+# Таблица ISS -> (класс записи, колонки по порядку полей). Первая колонка — дата строки,
+# строки без неё пропускаются.
+ISS_TABLES: dict[str, tuple[type, tuple[tuple[str, Callable], ...]]] = {
+    "coupons": (Coupon, (("coupondate", iso_date), ("value", to_float), ("valueprc", to_float))),
+    "amortizations": (Amortization, (("amortdate", iso_date), ("value", to_float), ("data_source", to_str))),
+    "offers": (Offer, (("offerdate", iso_date), ("offertype", to_str))),
+}
+
+
+def parse_iss_table(data: dict, table: str) -> list:
+    """
+    Разбирает блок {"columns": [...], "data": [[...], ...]} в записи за один проход:
+    индексы колонок определяются один раз по заголовку, дата строки парсится один раз.
+    """
+    record_cls, spec = ISS_TABLES[table]
+    block = data.get(table) or {}
+    columns = block.get("columns") or []
+    rows = block.get("data") or []
+    if not rows:
+        return []
+
+    index = {name: i for i, name in enumerate(columns)}
+    date_column, parse_row_date = spec[0]
+    date_idx = index.get(date_column)
+    if date_idx is None:
+        logger.warning(f"⚠️ В таблице {table} нет колонки {date_column}")
+        return []
+
+    # Отсутствующая колонка даёт пустое значение поля
+    getters = [(index.get(name), convert) for name, convert in spec[1:]]
+
+    records = []
+    append = records.append
+    for row in rows:
+        row_date = parse_row_date(row[date_idx])
+        if row_date is None:
+            continue
+        append(record_cls(row_date, *[convert(row[i] if i is not None else None) for i, convert in getters]))
+    return records
+
+
+def parse_bondization(data: dict) -> Bondization:
+    """Все таблицы bondization.json одним общим разборщиком."""
+    return Bondization(
+        coupons=parse_iss_table(data, "coupons"),
+        amortizations=parse_iss_table(data, "amortizations"),
+        offers=parse_iss_table(data, "offers"),
+    )
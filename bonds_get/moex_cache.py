@@ -0,0 +1,127 @@
+# bonds_get/moex_cache.py
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+from config import MOEX_CACHE_PATH, MOEX_CACHE_MAX_ENTRIES, MOEX_CACHE_TTL
+
+logger = logging.getLogger("moex_cache")
+
+
+class CachedResponse(NamedTuple):
+    body: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+
+def endpoint_kind(path: str) -> str:
+    """Тип эндпоинта ISS для выбора TTL."""
+    if "bondization" in path:
+        return "bondization"
+    if path.startswith("/engines/"):
+        return "market"
+    return "securities"
+
+
+class MoexResponseCache:
+    """
+    Постоянный кэш ответов MOEX ISS в SQLite, ключ — полный URL.
+    Хранит ETag/Last-Modified для условной ревалидации, вытесняет давно не читанные записи.
+    Запросы к SQLite (и синхронизация файла при записи) выполняются в отдельном потоке,
+    не блокируя event loop: все обращения идут через один поток, соединение одно.
+    """
+
+    def __init__(self, path: str = MOEX_CACHE_PATH, max_entries: int = MOEX_CACHE_MAX_ENTRIES,
+                 ttl: dict = MOEX_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="moex_cache")
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                body TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS ix_responses_accessed ON responses (accessed_at)")
+        (self._size,) = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.stale = 0  # Устаревшие ответы, отданные при недоступной MOEX
+        self.evictions = 0
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def get(self, url: str) -> Optional[CachedResponse]:
+        return await self._run(self._get, url)
+
+    async def touch(self, url: str, revalidated: bool = False):
+        """Отмечает чтение; после ответа 304 также продлевает свежесть записи."""
+        await self._run(self._touch, url, revalidated)
+
+    async def put(self, url: str, body: str, etag: Optional[str], last_modified: Optional[str]):
+        await self._run(self._put, url, body, etag, last_modified)
+
+    def _get(self, url: str) -> Optional[CachedResponse]:
+        row = self._db.execute(
+            "SELECT body, etag, last_modified, fetched_at FROM responses WHERE url = ?", (url,)
+        ).fetchone()
+        return CachedResponse(*row) if row else None
+
+    def is_fresh(self, entry: CachedResponse, kind: str) -> bool:
+        return time.time() - entry.fetched_at < self.ttl.get(kind, 0)
+
+    def _touch(self, url: str, revalidated: bool):
+        now = time.time()
+        if revalidated:
+            self._db.execute("UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE url = ?", (now, now, url))
+        else:
+            self._db.execute("UPDATE responses SET accessed_at = ? WHERE url = ?", (now, url))
+
+    def _put(self, url: str, body: str, etag: Optional[str], last_modified: Optional[str]):
+        now = time.time()
+        if self._db.execute("SELECT 1 FROM responses WHERE url = ?", (url,)).fetchone() is None:
+            self._size += 1
+        self._db.execute(
+            "INSERT OR REPLACE INTO responses (url, body, etag, last_modified, fetched_at, accessed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (url, body, etag, last_modified, now, now),
+        )
+        self._evict()
+
+    def _evict(self):
+        excess = self._size - self.max_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM responses WHERE url IN "
+                "(SELECT url FROM responses ORDER BY accessed_at LIMIT ?)",
+                (excess,),
+            )
+            self._size -= excess
+            self.evictions += excess
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.revalidated
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidated": self.revalidated,
+            "stale": self.stale,
+            "evictions": self.evictions,
+            "entries": self._size,
+            "hit_rate": round((self.hits + self.revalidated) / lookups, 3) if lookups else 0.0,
+        }
+
+    async def close(self):
+        await self._run(self._db.close)
+        self._executor.shutdown(wait=True)
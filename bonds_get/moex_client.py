@@ -0,0 +1,179 @@
+# bonds_get/moex_client.py
+import importlib.util
+import json
+import logging
+
+import httpx
+
+from config import (
+    MOEX_BASE_URL,
+    MOEX_HTTP2,
+    MOEX_TIMEOUT,
+    MOEX_CONNECT_TIMEOUT,
+    MOEX_MAX_CONNECTIONS,
+    MOEX_MAX_KEEPALIVE,
+    MOEX_CACHE_ENABLED,
+    MOEX_SYNC_UNAVAILABLE_PAUSES,
+)
+from bonds_get.moex_cache import MoexResponseCache, endpoint_kind
+from bonds_get.moex_policy import AdaptiveLimiter, CircuitBreaker, MoexUnavailable, call_with_policy
+from bonds_get.single_flight import SingleFlight
+
+logger = logging.getLogger("moex_client")
+
+_client: httpx.AsyncClient | None = None
+_cache: MoexResponseCache | None = None
+_flight = SingleFlight()  # Одновременные запросы одного URL идут в MOEX один раз
+_limiter = AdaptiveLimiter()
+_breaker = CircuitBreaker()
+
+
+def _create_client() -> httpx.AsyncClient:
+    http2 = MOEX_HTTP2
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning("MOEX_HTTP2 включён, но пакет h2 не установлен — используется HTTP/1.1")
+        http2 = False
+
+    return httpx.AsyncClient(
+        base_url=MOEX_BASE_URL,
+        http2=http2,
+        timeout=httpx.Timeout(MOEX_TIMEOUT, connect=MOEX_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=MOEX_MAX_CONNECTIONS,
+            max_keepalive_connections=MOEX_MAX_KEEPALIVE,
+        ),
+    )
+
+
+def get_moex_client() -> httpx.AsyncClient:
+    """Общий долгоживущий клиент MOEX ISS (создаётся при первом обращении)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+    return _client
+
+
+async def start_moex_client() -> httpx.AsyncClient:
+    client = get_moex_client()
+    logger.info(f"MOEX client started: {MOEX_BASE_URL}")
+    return client
+
+
+def get_moex_cache() -> MoexResponseCache | None:
+    global _cache
+    if MOEX_CACHE_ENABLED and _cache is None:
+        _cache = MoexResponseCache()
+    return _cache
+
+
+async def close_moex_client():
+    global _client, _cache
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        logger.info("MOEX client closed")
+    logger.info(f"MOEX coalesced requests: {_flight.coalesced}")
+    logger.info(f"MOEX policy: limit={int(_limiter.limit)}, breaker={_breaker.stats()}")
+    if _cache is not None:
+        logger.info(f"MOEX cache stats: {_cache.stats()}")
+        await _cache.close()
+        _cache = None
+
+
+async def moex_get_json(path: str, params: dict | None = None, allow_stale: bool = True) -> dict:
+    """
+    GET к ISS относительно MOEX_BASE_URL, например /securities/{isin}.json.
+    Одновременные запросы одного URL объединяются в один.
+    Свежий ответ берётся из дискового кэша; устаревший ревалидируется по ETag/Last-Modified.
+    Если MOEX недоступна, при allow_stale отдаётся устаревший ответ из кэша,
+    иначе (и когда кэша нет) поднимается MoexUnavailable.
+    """
+    client = get_moex_client()
+    url = str(client.build_request("GET", path, params=params).url)
+    return await _flight.do((url, allow_stale), lambda: _fetch_json(client, path, params, url, allow_stale))
+
+
+def coalesced_requests() -> int:
+    return _flight.coalesced
+
+
+def moex_available() -> bool:
+    return _breaker.state != "open"
+
+
+async def wait_for_moex():
+    """Ждёт закрытия предохранителя MOEX (фоновые задачи ставятся на паузу)."""
+    if not moex_available():
+        logger.warning("⏸ MOEX недоступна, ожидаем восстановления")
+        await _breaker.wait_closed()
+        logger.info("▶️ Продолжаем запросы к MOEX")
+
+
+async def moex_get_json_resuming(path: str, params: dict | None = None,
+                                 pauses: int = MOEX_SYNC_UNAVAILABLE_PAUSES) -> dict:
+    """
+    moex_get_json для фоновых задач: без устаревшего кэша, а при недоступной MOEX
+    запрос ждёт закрытия предохранителя и повторяется — задача встаёт на паузу, не теряя прогресс.
+    """
+    for pause in range(pauses):
+        await wait_for_moex()
+        try:
+            return await moex_get_json(path, params, allow_stale=False)
+        except MoexUnavailable as e:
+            logger.warning(f"⏸ {path}: MOEX недоступна ({e}), пауза {pause + 1}/{pauses}")
+    await wait_for_moex()
+    return await moex_get_json(path, params, allow_stale=False)
+
+
+def _is_moex_failure(outcome) -> bool:
+    """Сбой на стороне MOEX: сетевая ошибка, 5xx или 429 — повторяем и учитываем в предохранителе."""
+    if isinstance(outcome, httpx.Response):
+        return outcome.status_code >= 500 or outcome.status_code == 429
+    return isinstance(outcome, httpx.TransportError)
+
+
+async def _get(client: httpx.AsyncClient, path: str, params: dict | None, headers: dict | None = None) -> httpx.Response:
+    return await call_with_policy(
+        lambda: client.get(path, params=params, headers=headers),
+        _limiter, _breaker, _is_moex_failure,
+    )
+
+
+async def _fetch_json(client: httpx.AsyncClient, path: str, params: dict | None, url: str,
+                      allow_stale: bool) -> dict:
+    cache = get_moex_cache()
+    if cache is None:
+        response = await _get(client, path, params)
+        response.raise_for_status()
+        return response.json()
+
+    entry = await cache.get(url)
+    if entry and cache.is_fresh(entry, endpoint_kind(path)):
+        cache.hits += 1
+        await cache.touch(url)
+        return json.loads(entry.body)
+
+    headers = {}
+    if entry and entry.etag:
+        headers["If-None-Match"] = entry.etag
+    if entry and entry.last_modified:
+        headers["If-Modified-Since"] = entry.last_modified
+
+    try:
+        response = await _get(client, path, params, headers)
+    except MoexUnavailable as e:
+        if not (allow_stale and entry):
+            raise
+        cache.stale += 1
+        logger.warning(f"📦 MOEX недоступна ({e}), отдаём устаревший ответ из кэша: {path}")
+        return json.loads(entry.body)
+
+    if response.status_code == 304 and entry:
+        cache.revalidated += 1
+        await cache.touch(url, revalidated=True)
+        return json.loads(entry.body)
+
+    response.raise_for_status()
+    cache.misses += 1
+    await cache.put(url, response.text, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+    return response.json()
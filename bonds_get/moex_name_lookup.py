@@ -1,19 +1,15 @@
 # database.moex_name_lookup.py
-import httpx
 import logging
 
+from bonds_get.moex_client import moex_get_json
+
 
 async def get_bond_name_from_moex(isin: str) -> str | None:
     """
     Получает название облигации с MOEX по ISIN.
     """
-    url = f"https://iss.moex.com/iss/securities/{isin}.json"
-
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            data = response.json()
+        data = await moex_get_json(f"/securities/{isin}.json")
 
         # Логируем весь ответ от MOEX для диагностики
         logging.info(f"Ответ MOEX для ISIN {isin}: {data}")
@@ -0,0 +1,182 @@
+# bonds_get/moex_policy.py
+import asyncio
+import logging
+import random
+import time
+
+from config import (
+    MOEX_MIN_CONCURRENCY,
+    MOEX_MAX_CONCURRENCY,
+    MOEX_TARGET_LATENCY,
+    MOEX_RETRY_ATTEMPTS,
+    MOEX_RETRY_BASE_DELAY,
+    MOEX_BREAKER_THRESHOLD,
+    MOEX_BREAKER_RESET_SECONDS,
+)
+
+logger = logging.getLogger("moex_policy")
+
+
+class MoexUnavailable(Exception):
+    """MOEX ISS недоступна: открыт предохранитель или исчерпаны повторы."""
+
+
+class AdaptiveLimiter:
+    """
+    AIMD-лимит одновременных запросов: +1 за «окно» быстрых успешных ответов,
+    половина — при ошибке или ответе медленнее target_latency.
+    """
+
+    def __init__(self, minimum: int = MOEX_MIN_CONCURRENCY, maximum: int = MOEX_MAX_CONCURRENCY,
+                 target_latency: float = MOEX_TARGET_LATENCY):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._waiters: list[asyncio.Future] = []
+
+    async def acquire(self):
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+
+    def release(self, latency: float, ok: bool):
+        if ok and latency <= self.target_latency:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        else:
+            # Одно снижение на «окно» задержки, чтобы пачка медленных ответов не обнулила лимит
+            now = time.monotonic()
+            if now - self._last_decrease >= self.target_latency:
+                self._last_decrease = now
+                self.limit = max(self.minimum, self.limit / 2)
+                logger.warning(f"🐢 MOEX: лимит параллельных запросов снижен до {int(self.limit)}")
+        self.abandon()
+
+    def abandon(self):
+        """Освобождает слот без оценки исхода (запрос отменён вызывающим)."""
+        self.in_flight -= 1
+        # Ожидающие сами перепроверят лимит
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+class CircuitBreaker:
+    """
+    Предохранитель: после threshold ошибок подряд MOEX считается недоступной на reset_seconds,
+    затем пропускается один пробный запрос (half-open).
+    """
+
+    def __init__(self, threshold: int = MOEX_BREAKER_THRESHOLD, reset_seconds: float = MOEX_BREAKER_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_until = 0.0
+        self.probe_until = 0.0  # Пробный запрос в half-open; срок — на случай его отмены
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.failures < self.threshold:
+            return "closed"
+        now = time.monotonic()
+        return "open" if now < self.opened_until or now < self.probe_until else "half_open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open":
+            self.probe_until = time.monotonic() + self.reset_seconds
+            return True
+        return False
+
+    def record_success(self):
+        if self.failures >= self.threshold:
+            logger.info("✅ MOEX снова доступна, предохранитель закрыт")
+        self.failures = 0
+        self.probe_until = 0.0
+
+    def abandon_probe(self):
+        """Пробный запрос отменён вызывающим: следующий может пробовать сразу, счётчики не меняются."""
+        self.probe_until = 0.0
+
+    def record_failure(self):
+        self.failures += 1
+        self.probe_until = 0.0
+        if self.failures >= self.threshold:
+            if time.monotonic() >= self.opened_until:
+                self.trips += 1
+                logger.error(f"🚫 MOEX недоступна, предохранитель открыт на {self.reset_seconds:.0f} с")
+            self.opened_until = time.monotonic() + self.reset_seconds
+
+    async def wait_closed(self):
+        """Ждёт, пока предохранитель разрешит запросы (для фоновой синхронизации)."""
+        while self.state == "open":
+            await asyncio.sleep(max(self.opened_until - time.monotonic(), 0.5))
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "trips": self.trips}
+
+
+def retry_delay(attempt: int) -> float:
+    """Экспоненциальная задержка с полным джиттером."""
+    return random.uniform(0, MOEX_RETRY_BASE_DELAY * 2 ** attempt)
+
+
+async def call_with_policy(request, limiter: AdaptiveLimiter, breaker: CircuitBreaker,
+                           is_retryable, attempts: int = MOEX_RETRY_ATTEMPTS):
+    """
+    Выполняет request() с учётом предохранителя, адаптивного лимита и повторов.
+    is_retryable(result_or_exception) решает, считать ли исход сбоем MOEX.
+    """
+    error: Exception | None = None
+    for attempt in range(attempts):
+        if attempt:
+            await asyncio.sleep(retry_delay(attempt - 1))
+        if not breaker.allow():
+            raise MoexUnavailable("MOEX circuit breaker is open") from error
+
+        await limiter.acquire()
+        started = time.monotonic()
+        failed = True
+        cancelled = False
+        try:
+            result = await request()
+            failed = is_retryable(result)
+            if failed:
+                error = MoexUnavailable(f"MOEX responded {result.status_code}")
+        except asyncio.CancelledError:
+            # Отмена вызывающим (остановка, ушедший ожидающий single-flight) — не сбой MOEX
+            cancelled = True
+            breaker.abandon_probe()
+            raise
+        except Exception as e:
+            if not is_retryable(e):
+                failed = False  # Ошибка не на стороне MOEX — не повторяем и не штрафуем
+                breaker.record_success()
+                raise
+            error = e
+        finally:
+            if cancelled:
+                limiter.abandon()
+            else:
+                limiter.release(time.monotonic() - started, ok=not failed)
+
+        if not failed:
+            breaker.record_success()
+            return result
+
+        breaker.record_failure()
+        logger.warning(f"⚠️ Сбой MOEX (попытка {attempt + 1}/{attempts}): {error!r}")
+
+    raise MoexUnavailable(str(error)) from error
@@ -0,0 +1,123 @@
+# bonds_get/name_backfill.py
+
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from sqlalchemy import select, update, bindparam, or_
+
+from config import NAME_BACKFILL_BATCH_SIZE, NAME_BACKFILL_INTERVAL, NAME_BACKFILL_CONCURRENCY
+from database.db import get_session, BondsDatabase
+from database.portfolio import bump_bond_holders
+from bonds_get.bulk_sync import load_market_table
+from bonds_get.moex_name_lookup import get_bond_name_from_moex
+
+logger = logging.getLogger("name_backfill")
+
+_wakeup: Optional[asyncio.Event] = None
+# ISIN, для которых MOEX не вернул название: isin -> monotonic-время следующей попытки
+_unresolved: dict[str, float] = {}
+
+
+def request_name_backfill():
+    """Просит воркер заполнить недостающие названия, не дожидаясь интервала."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def load_unnamed_isins(limit: int) -> list[str]:
+    now = time.monotonic()
+    skip = [isin for isin, retry_at in _unresolved.items() if retry_at > now]
+    query = select(BondsDatabase.isin).where(or_(BondsDatabase.name.is_(None), BondsDatabase.name == ""))
+    if skip:
+        query = query.where(BondsDatabase.isin.notin_(skip))
+    async with get_session() as session:
+        result = await session.execute(query.order_by(BondsDatabase.id).limit(limit))
+        return list(result.scalars())
+
+
+async def resolve_names(isins: list[str], market: dict[str, dict]) -> dict[str, str]:
+    """
+    Названия пачкой: сначала из рыночной таблицы MOEX (SECNAME/SHORTNAME, одна постраничная
+    выгрузка на проход воркера), оставшиеся — запросом по ISIN с ограниченной параллельностью.
+    """
+    names = {}
+    for isin in isins:
+        record = market.get(isin)
+        if record and (name := record.get("SECNAME") or record.get("SHORTNAME")):
+            names[isin] = name
+
+    semaphore = asyncio.Semaphore(NAME_BACKFILL_CONCURRENCY)
+
+    async def lookup(isin: str):
+        async with semaphore:
+            if name := await get_bond_name_from_moex(isin):
+                names[isin] = name
+
+    await asyncio.gather(*(lookup(isin) for isin in isins if isin not in names))
+    return names
+
+
+async def backfill_names_batch(market: Optional[dict[str, dict]] = None,
+                               limit: int = NAME_BACKFILL_BATCH_SIZE) -> tuple[int, Optional[dict[str, dict]]]:
+    """
+    Заполняет названия для пачки облигаций без name.
+    market — рыночная таблица, уже загруженная в этом проходе; None — загрузить, если есть что заполнять.
+    Возвращает число обработанных ISIN и рыночную таблицу для следующей пачки.
+    """
+    isins = await load_unnamed_isins(limit)
+    if not isins:
+        return 0, market
+
+    if market is None:
+        market = await load_market_table() or {}
+    names = await resolve_names(isins, market)
+    if names:
+        stmt = (
+            update(BondsDatabase.__table__)
+            .where(BondsDatabase.__table__.c.isin == bindparam("b_isin"))
+            .values(name=bindparam("v_name"))
+        )
+        async with get_session() as session:
+            await session.execute(stmt, [{"b_isin": isin, "v_name": name} for isin, name in names.items()])
+            await session.commit()
+        # Название видно только в портфелях с этой бумагой — остальные снимки не сбрасываем
+        for isin in names:
+            bump_bond_holders(isin)
+
+    retry_at = time.monotonic() + NAME_BACKFILL_INTERVAL
+    for isin in isins:
+        if isin in names:
+            _unresolved.pop(isin, None)
+        else:
+            _unresolved[isin] = retry_at
+
+    logger.info(f"🏷️ Названия облигаций: заполнено {len(names)} из {len(isins)}")
+    return len(isins), market
+
+
+async def run_name_backfill_worker():
+    """Фоновый воркер: дозаполняет названия облигаций, пока процесс работает."""
+    global _wakeup
+    _wakeup = asyncio.Event()
+    logger.info("Name backfill worker started")
+
+    # Рыночная таблица загружается один раз на проход (серию полных пачек), а не на каждую пачку
+    market = None
+    while True:
+        _wakeup.clear()
+        try:
+            processed, market = await backfill_names_batch(market)
+        except Exception as e:
+            logger.error(f"Ошибка заполнения названий: {e}", exc_info=True)
+            processed = 0
+
+        # Полная пачка — возможно, есть ещё бумаги без названия
+        if processed >= NAME_BACKFILL_BATCH_SIZE:
+            continue
+        market = None
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=NAME_BACKFILL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
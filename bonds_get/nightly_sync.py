@@ -1,11 +1,22 @@
 # bonds_get/nightly_sync.py
 
+import asyncio
 import logging
+import time
 from datetime import datetime, date
-from sqlalchemy import select
+from typing import AsyncIterator
+from sqlalchemy import select, update, bindparam
 from sqlalchemy.ext.asyncio import AsyncSession
-from database.db import get_session, BondsDatabase
-from bonds_get.moex_lookup import get_bondization_data_from_moex
+from config import SYNC_CONCURRENCY, SYNC_BATCH_SIZE, SYNC_MODE, STREAM_CHUNK_SIZE
+from database.db import get_session, BondsDatabase, db_pool_stats
+from database.portfolio import bump_data_epoch, portfolio_cache_stats
+from bonds_get.moex_lookup import parse_bondization_payload, bondization_fingerprint
+from bonds_get.bond_events import events_from_bondization, replace_events, refresh_events_from_bonds
+from bonds_get.bond_schedule import (
+    store_schedules, last_coupon_dates, schedule_is_stale, load_schedules, compute_bond_update
+)
+from bonds_get.bulk_sync import load_market_table, sync_from_market_tables
+from bonds_get.moex_client import get_moex_cache, coalesced_requests, moex_get_json_resuming
 
 logger = logging.getLogger("nightly_sync")
 
@@ -40,94 +51,247 @@ async def needs_update(bond: BondsDatabase) -> bool:
     return any(field is None for field in empty_fields)
 
 
-async def update_bond_data(bond: BondsDatabase, session: AsyncSession):
-    """Унифицированная версия обновления (аналогично bond_update)"""
+async def write_rows(session: AsyncSession, batch: list[tuple], today: date):
+    """
+    Пишет пачку результатов набором пакетных запросов, без запроса на каждую облигацию:
+    executemany UPDATE bonds_database (по группам с одинаковым набором колонок),
+    графики и события — одним DELETE и одной пакетной вставкой на таблицу.
+    """
+    now = datetime.utcnow()
+    bonds = BondsDatabase.__table__
+    updates: dict[tuple, list[dict]] = {}
+    schedules = {}
+    events = {}
+
+    for isin, changes, bond_events, schedule in batch:
+        values = dict(changes)
+        if changes:
+            values["last_updated"] = now
+        if schedule is not None:
+            schedules[isin] = schedule
+            values.update(schedule_fetched_at=now, payload_hash=schedule["payload_hash"])
+        if values:
+            updates.setdefault(tuple(sorted(values)), []).append(
+                {"b_isin": isin, **{f"v_{column}": value for column, value in values.items()}}
+            )
+        if bond_events is not None:
+            events[isin] = bond_events
+
+    await store_schedules(session, schedules)
+    for columns, params in updates.items():
+        await session.execute(
+            update(bonds)
+            .where(bonds.c.isin == bindparam("b_isin"))
+            .values({column: bindparam(f"v_{column}") for column in columns}),
+            params,
+        )
+    if events:
+        await replace_events(session, events, today)
+
+
+async def write_batch(batch: list[tuple], stats: dict, today: date):
+    """
+    Пишет пачку результатов одной транзакцией. Если пачка не прошла,
+    повторяет по одной облигации, чтобы ошибка одного ISIN не откатила остальные.
+    """
     try:
-        logger.info(f"🔄 Начинаем обновление для {bond.isin}")
-        data = await get_bondization_data_from_moex(bond.isin)
-        today = date.today()
-
-        # Основные поля
-        updates_made = False
-        if data.get("maturity_date"):
-            bond.maturity_date = data["maturity_date"]
-            updates_made = True
-            logger.info(f"📅 Дата погашения: {bond.maturity_date}")
-
-        if data.get("next_offer_date"):
-            bond.offer_date = data["next_offer_date"]
-            updates_made = True
-            logger.info(f"📆 Дата оферты: {bond.offer_date}")
-
-        # Обработка купонов
-        upcoming_coupons = []
-        for c in data.get("coupons", []):
-            if raw_date := c.get("couponDate"):
-                try:
-                    parsed_date = datetime.strptime(raw_date, "%Y-%m-%d").date()
-                    if parsed_date > today:
-                        upcoming_coupons.append({
-                            "date": parsed_date,
-                            "value": c.get("couponValue", 0.0)
-                        })
-                except ValueError:
-                    logger.warning(f"⚠️ Невалидная дата купона: {raw_date}")
-
-        if upcoming_coupons:
-            next_coupon = min(upcoming_coupons, key=lambda x: x["date"])
-            bond.next_coupon_date = next_coupon["date"]
-            bond.next_coupon_value = float(next_coupon["value"])
-            logger.info(f"✅ Купон: {bond.next_coupon_date}, {bond.next_coupon_value}")
-            updates_made = True
-
-        # Обработка амортизаций
-        upcoming_amorts = []
-        for a in data.get("amortizations", []):
-            if a.get("dataSource") == "amortization" and (raw_date := a.get("amortDate")):
-                try:
-                    parsed_date = datetime.strptime(raw_date, "%Y-%m-%d").date()
-                    if parsed_date >= today:
-                        upcoming_amorts.append({
-                            "date": parsed_date,
-                            "value": a.get("amortValue", 0.0)
-                        })
-                except ValueError:
-                    logger.warning(f"⚠️ Невалидная дата амортизации: {raw_date}")
-
-        if upcoming_amorts:
-            next_amort = min(upcoming_amorts, key=lambda x: x["date"])
-            bond.amortization_date = next_amort["date"]
-            bond.amortization_value = float(next_amort["value"])
-            logger.info(f"✅ Амортизация: {bond.amortization_date}, {bond.amortization_value}")
-            updates_made = True
-
-        if updates_made:
-            bond.last_updated = datetime.utcnow()
+        async with get_session() as session:
+            await write_rows(session, batch, today)
             await session.commit()
-            logger.info(f"✅ Успешное обновление {bond.isin}")
-
     except Exception as e:
-        logger.error(f"❌ Ошибка при обновлении {bond.isin}: {e}", exc_info=True)
-        await session.rollback()
-        raise
+        logger.warning(f"⚠️ Пачка из {len(batch)} облигаций не записана ({e}), записываем по одной")
+        for item in batch:
+            isin, changes = item[0], item[1]
+            try:
+                async with get_session() as session:
+                    await write_rows(session, [item], today)
+                    await session.commit()
+                stats["updated" if changes else "unchanged"] += 1
+            except Exception as e:
+                logger.error(f"❌ Ошибка при записи {isin}: {e}", exc_info=True)
+                stats["failed"] += 1
+        return
+
+    for isin, changes, _, _ in batch:
+        stats["updated" if changes else "unchanged"] += 1
+        if changes:
+            logger.info(f"✅ Успешное обновление {isin}: {changes}")
 
 
-async def perform_nightly_sync():
-    """Основная функция ночной сверки"""
-    logger.info("🌙 Запуск ночной сверки данных")
+async def recompute_locally(bonds: list, stats: dict, today: date, batch_size: int):
+    """Пересчитывает ближайшие события по сохранённым графикам, без запросов к MOEX."""
+    for i in range(0, len(bonds), batch_size):
+        chunk = bonds[i:i + batch_size]
+        async with get_session() as session:
+            schedules = await load_schedules(session, [bond.isin for bond in chunk], today)
+        await write_batch([
+            (bond.isin, compute_bond_update(bond, schedules[bond.isin], today), None, None)
+            for bond in chunk
+        ], stats, today)
 
+
+async def sync_bonds_per_isin(bonds: list, stats: dict, today: date,
+                              concurrency: int = SYNC_CONCURRENCY, batch_size: int = SYNC_BATCH_SIZE):
+    """
+    Обновляет облигации по графикам. Если сохранённый график свежий, ближайшие события
+    считаются локально из bond_coupons/bond_amortizations/bond_offers. Иначе bondization
+    запрашивается с MOEX параллельно; если отпечаток ответа совпал с payload_hash,
+    разбор и запись графика пропускаются.
+    """
     async with get_session() as session:
-        try:
-            result = await session.execute(select(BondsDatabase))
-            bonds = result.scalars().all()
+        last_coupons = await last_coupon_dates(session, [bond.isin for bond in bonds])
+
+    remote = []
+    local = []
+    for bond in bonds:
+        if schedule_is_stale(bond, last_coupons.get(bond.isin), today):
+            remote.append(bond)
+        else:
+            local.append(bond)
+    logger.info(f"📚 Локальный пересчёт: {len(local)}, запрос к MOEX: {len(remote)}")
+
+    await recompute_locally(local, stats, today, batch_size)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(bond: BondsDatabase):
+        async with semaphore:
+            try:
+                logger.info(f"🔄 Начинаем обновление для {bond.isin}")
+                payload = await moex_get_json_resuming(f"/securities/{bond.isin}/bondization.json")
+                if bondization_fingerprint(payload) == bond.payload_hash:
+                    return bond, None, True
+                return bond, await parse_bondization_payload(bond.isin, payload), False
+            except Exception as e:
+                logger.error(f"❌ Ошибка при обновлении {bond.isin}: {e}")
+                return bond, None, False
+
+    batch = []
+    same_payload = []
+    for next_done in asyncio.as_completed([fetch(bond) for bond in remote]):
+        bond, data, unchanged = await next_done
+        if unchanged:
+            same_payload.append(bond)
+            continue
+        if data is None:
+            stats["failed"] += 1
+            continue
+
+        batch.append((bond.isin, compute_bond_update(bond, data, today), events_from_bondization(data, today), data))
+        if len(batch) >= batch_size:
+            await write_batch(batch, stats, today)
+            batch = []
+
+    if batch:
+        await write_batch(batch, stats, today)
+
+    # График на MOEX не изменился: продлеваем его свежесть одним UPDATE и считаем локально
+    if same_payload:
+        logger.info(f"🟰 Ответ MOEX не изменился для {len(same_payload)} облигаций")
+        async with get_session() as session:
+            await session.execute(
+                update(BondsDatabase)
+                .where(BondsDatabase.isin.in_([bond.isin for bond in same_payload]))
+                .values(schedule_fetched_at=datetime.utcnow())
+            )
+            await session.commit()
+        await recompute_locally(same_payload, stats, today, batch_size)
+
+
+# Колонки BondsDatabase, которые нужны сверке: строки вместо ORM-объектов
+SYNC_COLUMNS = (
+    BondsDatabase.isin,
+    BondsDatabase.name,
+    BondsDatabase.next_coupon_date,
+    BondsDatabase.next_coupon_value,
+    BondsDatabase.offer_date,
+    BondsDatabase.amortization_date,
+    BondsDatabase.amortization_value,
+    BondsDatabase.maturity_date,
+    BondsDatabase.schedule_fetched_at,
+    BondsDatabase.payload_hash,
+)
+
+
+async def stream_bonds(chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[list]:
+    """
+    Каталог облигаций частями по chunk_size строк: постранично по id (WHERE id > :last ORDER BY id LIMIT),
+    каждая страница — в своей короткой сессии. Соединение не удерживается, пока часть
+    обрабатывается и ждёт ответов MOEX, и транзакция не висит открытой всю сверку.
+    """
+    last_id = 0
+    while True:
+        async with get_session() as session:
+            result = await session.execute(
+                select(BondsDatabase.id, *SYNC_COLUMNS)
+                .where(BondsDatabase.id > last_id)
+                .order_by(BondsDatabase.id)
+                .limit(chunk_size)
+            )
+            chunk = result.all()
+        if not chunk:
+            return
+        last_id = chunk[-1].id
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+
+
+async def perform_nightly_sync(
+        concurrency: int = SYNC_CONCURRENCY,
+        batch_size: int = SYNC_BATCH_SIZE,
+        mode: str = SYNC_MODE,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+) -> dict:
+    """
+    Основная функция ночной сверки.
+    mode="bulk": сначала рыночные таблицы MOEX одним набором запросов на весь каталог,
+    затем bondization по отдельным ISIN только там, где нужен график амортизаций.
+    mode="per_isin": bondization по каждой облигации, которой требуется обновление.
+    Каталог читается постранично по id, по chunk_size строк, так что память не растёт
+    с числом облигаций. Запросы к MOEX идут параллельно (не больше concurrency одновременно),
+    запись в БД — пачками по batch_size. Возвращает сводку updated/unchanged/failed.
+    """
+    logger.info(f"🌙 Запуск ночной сверки данных (mode={mode}, concurrency={concurrency}, batch={batch_size})")
+    started = time.monotonic()
+    today = date.today()
+    stats = {"updated": 0, "unchanged": 0, "failed": 0}
 
+    try:
+        market = await load_market_table() if mode == "bulk" else None
+
+        async for bonds in stream_bonds(chunk_size):
+            if market is not None:
+                bonds = await sync_from_market_tables(bonds, market, stats, today, batch_size)
+
+            to_update = []
             for bond in bonds:
                 if await needs_update(bond):
-                    await update_bond_data(bond, session)
+                    to_update.append(bond)
                 else:
                     logger.debug(f"✓ {bond.isin} не требует обновления")
+                    stats["unchanged"] += 1
+
+            await sync_bonds_per_isin(to_update, stats, today, concurrency, batch_size)
 
-        except Exception as e:
-            logger.error(f"🚨 Критическая ошибка: {e}")
+        # События для облигаций, которые не запрашивались на MOEX; прошедшие — удаляются
+        async with get_session() as session:
+            await refresh_events_from_bonds(session, today)
+            await session.commit()
+
+    except Exception as e:
+        logger.error(f"🚨 Критическая ошибка: {e}", exc_info=True)
+    finally:
+        # Даже частичная сверка могла изменить облигации в портфелях
+        await bump_data_epoch()
 
-    logger.info("🏁 Сверка завершена")
\ No newline at end of file
+    stats["seconds"] = round(time.monotonic() - started, 1)
+    logger.info(
+        f"🏁 Сверка завершена: обновлено {stats['updated']}, без изменений {stats['unchanged']}, "
+        f"ошибок {stats['failed']}, время {stats['seconds']} с"
+    )
+    if cache := get_moex_cache():
+        logger.info(f"📊 Кэш MOEX: {cache.stats()}, объединено запросов: {coalesced_requests()}")
+    logger.info(f"📊 Пул БД: {db_pool_stats()}")
+    logger.info(f"📊 Кэш портфелей: {portfolio_cache_stats()}")
+    return stats
@@ -0,0 +1,35 @@
+# bonds_get/single_flight.py
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные вызовы с одинаковым ключом: пока запрос выполняется,
+    остальные вызывающие ждут его и получают тот же результат (или то же исключение).
+    Результат общий — вызывающие не должны его изменять.
+    """
+
+    def __init__(self):
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+        # shield: отмена одного вызывающего не отменяет общий запрос для остальных
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def in_flight(self) -> int:
+        return len(self._inflight)
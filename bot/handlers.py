@@ -4,10 +4,9 @@ import html
 import logging
 import os
 import re
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 from sqlalchemy import select, update
-from sqlalchemy.orm import selectinload
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram import Update, Message
 from telegram.constants import ParseMode
@@ -25,8 +24,14 @@ from yookassa import Configuration, Payment
 from bonds_get.bond_update import get_next_coupon
 from bonds_get.bond_utils import is_bond
 from bonds_get.moex_name_lookup import get_bond_name_from_moex
+from bonds_get.moex_policy import MoexUnavailable
+from bonds_get.name_backfill import request_name_backfill
+from bot.render_cache import events_text_cache
 from bot.subscription_utils import check_tracking_limit
 from database.db import get_session, User, BondsDatabase, UserTracking, Subscription
+from database.portfolio import (
+    Portfolio, UpcomingEvent, load_portfolio, load_upcoming_events, bump_portfolio_version,
+)
 
 Configuration.account_id = os.getenv("YOOKASSA_SHOP_ID")
 Configuration.secret_key = os.getenv("YOOKASSA_SECRET_KEY")
@@ -240,33 +245,22 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def list_tracked_bonds(update: Update, context: ContextTypes.DEFAULT_TYPE):
     async with get_session() as session:
-        result = await session.execute(
-            select(User)
-            .options(selectinload(User.tracked_bonds))
-            .filter_by(tg_id=update.effective_user.id)
-        )
-        user = result.scalar()
+        portfolio = await load_portfolio(session, update.effective_user.id)
 
-        if not user or not user.tracked_bonds:
+        if not portfolio or not portfolio.holdings:
             await update.message.reply_text("❗️Вы пока не отслеживаете ни одной облигации.")
             return
 
-        text = "📋 Вот список ваших отслеживаемых бумаг:\n\n"
-        for ut in user.tracked_bonds:
-            bond_result = await session.execute(select(BondsDatabase).filter_by(isin=ut.isin))
-            bond = bond_result.scalar()
-
-            name = bond.name or bond.isin
-            if not bond.name:
-                moex_name = await get_bond_name_from_moex(bond.isin)
-                if moex_name:
-                    bond.name = moex_name
-                    await session.commit()
-                    name = moex_name
+    # Названия без MOEX в обработчике: недостающие дозаполнит фоновый воркер, пока — ISIN
+    if any(not bond.name for _, bond in portfolio.holdings):
+        request_name_backfill()
 
-            text += f"• {name} - {ut.quantity} бумаг \n({bond.isin}, добавлена {ut.added_at.strftime('%Y-%m-%d')})\n\n"
+    text = "📋 Вот список ваших отслеживаемых бумаг:\n\n"
+    for ut, bond in portfolio.holdings:
+        name = bond.name or bond.isin
+        text += f"• {name} - {ut.quantity} бумаг \n({bond.isin}, добавлена {ut.added_at.strftime('%Y-%m-%d')})\n\n"
 
-        await update.message.reply_text(text)
+    await update.message.reply_text(text)
 
 
 async def process_add_isin(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -290,7 +284,16 @@ async def process_add_isin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return AWAITING_ISIN_TO_ADD
 
     # Основная проверка на облигацию через MOEX API
-    if not await is_bond(text):
+    try:
+        bond_found = await is_bond(text)
+    except MoexUnavailable:
+        await update.message.reply_text(
+            "⏳ Московская биржа сейчас не отвечает, проверить ISIN не удалось.\n"
+            "Попробуйте ещё раз через несколько минут."
+        )
+        return AWAITING_ISIN_TO_ADD
+
+    if not bond_found:
         await update.message.reply_text(
             "❌ Введен некорректный ISIN или бумага не является облигацией.\n"
             "Проверьте правильность кода и попробуйте снова."
@@ -340,6 +343,7 @@ async def process_add_isin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         tracking = UserTracking(user_id=user_db.tg_id, isin=bond.isin)
         session.add(tracking)
         await session.commit()
+        bump_portfolio_version(user_db.tg_id)
 
         context.user_data['isin'] = text
         await update.message.reply_text(f"Введите количество бумаг для {bond.name or bond.isin}:")
@@ -372,11 +376,13 @@ async def process_quantity(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if existing_tracking:
                 existing_tracking.quantity = quantity
                 await session.commit()
+                bump_portfolio_version(user_db.tg_id)
                 await update.message.reply_text(f"✅ Количество обновлено: {quantity}")
             else:
                 tracking = UserTracking(user_id=user_db.tg_id, isin=bond.isin, quantity=quantity)
                 session.add(tracking)
                 await session.commit()
+                bump_portfolio_version(user_db.tg_id)
                 await update.message.reply_text(f"📌 Облигация добавлена! Количество: {quantity}")
 
         return ConversationHandler.END
@@ -417,6 +423,7 @@ async def process_remove_isin(update: Update, context: ContextTypes.DEFAULT_TYPE
         if tracking:
             await session.delete(tracking)
             await session.commit()
+            bump_portfolio_version(user.tg_id)
             await update.message.reply_text(f"✅ Бумага {isin} удалена!")
         else:
             await update.message.reply_text(f"❌ Бумага {isin} не найдена!")
@@ -424,105 +431,96 @@ async def process_remove_isin(update: Update, context: ContextTypes.DEFAULT_TYPE
         return ConversationHandler.END
 
 
-async def show_events(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    async with get_session() as session:
-        user_result = await session.execute(
-            select(User)
-            .options(selectinload(User.tracked_bonds))
-            .filter_by(tg_id=update.effective_user.id)
-        )
-        user = user_result.scalar()
+def render_events(portfolio: Portfolio, events: dict[str, dict[str, UpcomingEvent]]) -> str:
+    """Текст /events: ближайшие события каждого типа по бумагам портфеля (из bond_events)."""
+    text = "📊 Ближайшие события по вашим облигациям:\n\n"
+    for ut, bond in portfolio.holdings:
+        name = bond.name or bond.isin
+        quantity = ut.quantity or 1
+        bond_events = events.get(bond.isin, {})
+        event_lines = []
+
+        # Обработка купонов
+        if coupon := bond_events.get("coupon"):
+            coupon_status = []
+            if coupon.amount is not None and coupon.amount != 0:
+                total_coupon = quantity * coupon.amount
+                coupon_status.append(
+                    f"купон {coupon.amount:.2f} руб.\n"
+                    f"💰Итого: {total_coupon:.2f} руб. для {quantity} шт."
+                )
+            else:
+                coupon_status.append("размер купона не указан")
 
-        if not user or not user.tracked_bonds:
-            await update.message.reply_text(
-                "❗️ Вы пока что не отслеживаете ни одной облигации.\nДобавьте бумагу при помощи /add")
-            return
+            event_lines.append(
+                f"🏷️ {coupon.event_date} — " + "\n".join(coupon_status)
+            )
 
-        text = "📊 Ближайшие события по вашим облигациям:\n\n"
-        for ut in user.tracked_bonds:
-            bond_result = await session.execute(
-                select(BondsDatabase).filter_by(isin=ut.isin))
-            bond = bond_result.scalar()
+        # Погашение
+        if maturity := bond_events.get("maturity"):
+            event_lines.append(f"💸🔙 {maturity.event_date} — погашение")
 
-            if not bond:
-                continue
-
-            name = bond.name or bond.isin
-            quantity = ut.quantity or 1
-            event_lines = []
-
-            # Обработка купонов
-            if bond.next_coupon_date:
-                coupon_status = []
-                if bond.next_coupon_value is not None and bond.next_coupon_value != 0:
-                    total_coupon = quantity * bond.next_coupon_value
-                    coupon_status.append(
-                        f"купон {bond.next_coupon_value:.2f} руб.\n"
-                        f"💰Итого: {total_coupon:.2f} руб. для {quantity} шт."
-                    )
-                else:
-                    coupon_status.append("размер купона не указан")
-
-                event_lines.append(
-                    f"🏷️ {bond.next_coupon_date} — " + "\n".join(coupon_status)
-                )
+        # Амортизация
+        if amortization := bond_events.get("amortization"):
+            amort_status = []
+            if amortization.amount is not None:
+                amort_status.append(f"{amortization.amount:.2f} руб.")
+            else:
+                amort_status.append("сумма не указана")
 
-            # Погашение
-            if bond.maturity_date:
-                event_lines.append(f"💸🔙 {bond.maturity_date} — погашение")
+            event_lines.append(
+                f"⬇️ Амортизация {amortization.event_date} — " + "\n".join(amort_status)
+            )
 
-            # Амортизация
-            if bond.amortization_date:
-                amort_status = []
-                if bond.amortization_value is not None:
-                    amort_status.append(f"{bond.amortization_value:.2f} руб.")
-                else:
-                    amort_status.append("сумма не указана")
+        # Оферта
+        if offer := bond_events.get("offer"):
+            event_lines.append(f"🤝📝 Оферта — {offer.event_date}")
 
-                event_lines.append(
-                    f"⬇️ Амортизация {bond.amortization_date} — " + "\n".join(amort_status)
-                )
+        # Формирование блока
+        if event_lines:
+            text += f"• {name}:\n" + "\n".join([f"  {line}" for line in event_lines]) + "\n\n"
+        else:
+            text += f"• {name}:\n  ✨ Нет ближайших событий\n\n"
 
-            # Оферта
-            if bond.offer_date:
-                event_lines.append(f"🤝📝 Оферта — {bond.offer_date}")
+    return text
 
-            # Формирование блока
-            if event_lines:
-                text += f"• {name}:\n" + "\n".join([f"  {line}" for line in event_lines]) + "\n\n"
-            else:
-                text += f"• {name}:\n  ✨ Нет ближайших событий\n\n"
 
-        await update.message.reply_text(text)
+async def show_events(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tg_id = update.effective_user.id
+    async with get_session() as session:
+        portfolio = await load_portfolio(session, tg_id)
+
+        if not portfolio or not portfolio.holdings:
+            await update.message.reply_text(
+                "❗️ Вы пока что не отслеживаете ни одной облигации.\nДобавьте бумагу при помощи /add")
+            return
+
+        # Текст меняется вместе с портфелем, данными облигаций (версия снимка и эпоха) и датой
+        today = date.today()
+        key = (portfolio.version, portfolio.epoch, today)
+        text = events_text_cache.get(tg_id, key)
+        if text is None:
+            events = await load_upcoming_events(session, tg_id, today)
+            text = render_events(portfolio, events)
+            events_text_cache.put(tg_id, key, text)
+
+    await update.message.reply_text(text)
 
 
 async def change_quantity(update: Update, context: ContextTypes.DEFAULT_TYPE):
     async with get_session() as session:
-        # Асинхронный запрос пользователя с отслеживаемыми бумагами
-        user_result = await session.execute(
-            select(User)
-            .options(selectinload(User.tracked_bonds))
-            .filter_by(tg_id=update.effective_user.id))
-        user = user_result.scalar()
+        # Пользователь и его бумаги одним JOIN-запросом
+        portfolio = await load_portfolio(session, update.effective_user.id)
 
-        if not user or not user.tracked_bonds:
+        if not portfolio or not portfolio.holdings:
             await update.message.reply_text(
                 "❗️ Вы пока что не отслеживаете ни одной облигации.\nДобавьте бумагу при помощи /add")
             return
 
-        keyboard = []
-        for ut in user.tracked_bonds:
-            bond_result = await session.execute(
-                select(BondsDatabase).filter_by(isin=ut.isin))
-            bond = bond_result.scalar()
-
-            if bond:
-                keyboard.append([
-                    InlineKeyboardButton(
-                        f"{bond.name or bond.isin} — Количество: {ut.quantity}",
-                        callback_data=bond.isin
-                    )
-                ])
+        keyboard = [
+            [InlineKeyboardButton(f"{bond.name or bond.isin} — Количество: {ut.quantity}", callback_data=bond.isin)]
+            for ut, bond in portfolio.holdings
+        ]
 
         await update.message.reply_text(
             "📋 Выберите облигацию для изменения количества:",
@@ -0,0 +1,50 @@
+# bot/render_cache.py
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from config import PORTFOLIO_CACHE_MAX_USERS
+
+
+class RenderedCache:
+    """
+    Готовые тексты ответов по пользователю, LRU по числу пользователей.
+    Ключ версии — (version, epoch) снимка портфеля и дата: пока портфель и данные облигаций
+    не менялись и день тот же, текст тот же; при несовпадении запись считается устаревшей.
+    """
+
+    def __init__(self, max_users: int = PORTFOLIO_CACHE_MAX_USERS):
+        self.max_users = max_users
+        self._entries: OrderedDict[int, tuple[Hashable, str]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, tg_id: int, key: Hashable) -> Optional[str]:
+        entry = self._entries.get(tg_id)
+        if entry is None or entry[0] != key:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(tg_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, tg_id: int, key: Hashable, text: str):
+        self._entries[tg_id] = (key, text)
+        self._entries.move_to_end(tg_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+# Текст /events по пользователю
+events_text_cache = RenderedCache()
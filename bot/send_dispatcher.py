@@ -0,0 +1,189 @@
+# bot/send_dispatcher.py
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from typing import Optional
+
+from telegram import Bot
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError
+from telegram.ext import Application
+
+from config import SEND_RATE_PER_SECOND, SEND_PER_CHAT_INTERVAL, SEND_WORKERS, SEND_MAX_RETRIES
+
+logger = logging.getLogger("send_dispatcher")
+
+# Как часто (с) удалять из _chat_next_slot чаты, чей следующий слот уже наступил
+CHAT_SLOT_SWEEP_SECONDS = 60.0
+
+
+class TokenBucket:
+    """Глобальный лимит: не больше rate сообщений в секунду, с паузой после RetryAfter."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class SendDispatcher:
+    """
+    Очередь исходящих сообщений с ограниченным числом отправителей.
+    Соблюдает глобальный лимит Telegram, лимит на чат и RetryAfter.
+    """
+
+    def __init__(
+            self,
+            bot: Bot,
+            rate: float = SEND_RATE_PER_SECOND,
+            per_chat_interval: float = SEND_PER_CHAT_INTERVAL,
+            workers: int = SEND_WORKERS,
+            max_retries: int = SEND_MAX_RETRIES,
+    ):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self.max_retries = max_retries
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._chat_next_slot: dict[int, float] = {}
+        self._chat_slots_swept_at = time.monotonic()
+        self._tasks: list[asyncio.Task] = []
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Send dispatcher started: {self.workers} workers, {self.bucket.rate} msg/s")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info(f"Send dispatcher stopped: {self.stats()}")
+
+    def submit(self, chat_id: int, text: str) -> asyncio.Future:
+        """
+        Ставит сообщение в очередь. Future завершится True (отправлено)
+        или исключением последней попытки (Forbidden, BadRequest, NetworkError...).
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((chat_id, text, 0, future))
+        return future
+
+    async def join(self):
+        """Ждёт, пока очередь не будет полностью разобрана."""
+        await self.queue.join()
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "queue_depth": self.queue.qsize(),
+            "tracked_chats": len(self._chat_next_slot),
+        }
+
+    async def _wait_chat_slot(self, chat_id: int):
+        # Резервируем слот для чата заранее, чтобы воркеры не отправили в один чат одновременно
+        now = time.monotonic()
+        if now - self._chat_slots_swept_at >= CHAT_SLOT_SWEEP_SECONDS:
+            self._sweep_chat_slots(now)
+        slot = max(now, self._chat_next_slot.get(chat_id, 0.0))
+        self._chat_next_slot[chat_id] = slot + self.per_chat_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def _sweep_chat_slots(self, now: float):
+        # Прошедший слот ничего не ограничивает — без записи чат получит слот now, как и с ней.
+        # Иначе словарь рос бы на каждый чат, которому когда-либо писали
+        self._chat_next_slot = {chat_id: slot for chat_id, slot in self._chat_next_slot.items() if slot > now}
+        self._chat_slots_swept_at = now
+
+    def _requeue(self, chat_id: int, text: str, attempt: int, future: asyncio.Future) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        self.retried += 1
+        self.queue.put_nowait((chat_id, text, attempt + 1, future))
+        return True
+
+    async def _worker(self, number: int):
+        while True:
+            chat_id, text, attempt, future = await self.queue.get()
+            try:
+                await self._wait_chat_slot(chat_id)
+                await self.bucket.acquire()
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                self.sent += 1
+                if not future.done():
+                    future.set_result(True)
+                logger.debug(f"Notification sent to user {chat_id}")
+
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                delay = retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+                logger.warning(f"RetryAfter {delay}s for chat {chat_id}, pausing dispatcher")
+                self.bucket.pause(delay)
+                if not self._requeue(chat_id, text, attempt, future):
+                    self._fail(chat_id, future, e)
+
+            except (Forbidden, BadRequest) as e:
+                # Пользователь заблокировал бота или чат недоступен — повтор не поможет
+                self._fail(chat_id, future, e)
+
+            except (TimedOut, NetworkError) as e:
+                logger.warning(f"Network error sending to {chat_id}: {e}")
+                if not self._requeue(chat_id, text, attempt, future):
+                    self._fail(chat_id, future, e)
+
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.cancel()
+                raise
+
+            except Exception as e:
+                self._fail(chat_id, future, e)
+
+            finally:
+                self.queue.task_done()
+
+    def _fail(self, chat_id: int, future: asyncio.Future, error: Exception):
+        self.failed += 1
+        if not future.done():
+            future.set_exception(error)
+        logger.error(f"Error sending notification to user {chat_id}: {error}")
+
+
+def get_send_dispatcher(app: Application) -> SendDispatcher:
+    """Возвращает общий диспетчер приложения, создавая его при первом обращении."""
+    dispatcher = app.bot_data.get("send_dispatcher")
+    if dispatcher is None:
+        dispatcher = SendDispatcher(app.bot)
+        dispatcher.start()
+        app.bot_data["send_dispatcher"] = dispatcher
+    return dispatcher
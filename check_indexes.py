@@ -0,0 +1,91 @@
+# check_indexes.py
+"""
+Проверяет по EXPLAIN, что основные запросы бота используют индексы из миграций.
+
+    python check_indexes.py
+
+На маленьких таблицах планировщик предпочитает Seq Scan, поэтому на время проверки
+выключается enable_seqscan: так видно, что подходящий индекс есть и применим.
+"""
+import asyncio
+import json
+import sys
+from datetime import date, datetime
+
+from sqlalchemy import select, text, update
+from sqlalchemy.dialects import postgresql
+
+from database.db import (
+    get_session, engine, User, Subscription, BondsDatabase, UserTracking, UserNotification, NotificationOutbox,
+)
+from database.portfolio import portfolio_query, upcoming_events_query
+from notification import due_events_query
+
+ISIN = "RU000A105740"
+USER_ID = 123456789
+
+# (описание, запрос, индекс, который должен быть в плане)
+CHECKS = [
+    ("User по tg_id (handlers)", select(User).filter_by(tg_id=USER_ID), "ix_users_tg_id"),
+    ("BondsDatabase по isin (handlers)", select(BondsDatabase).filter_by(isin=ISIN), "bonds_database_isin_key"),
+    ("UserTracking по (user_id, isin) (handlers)",
+     select(UserTracking).filter_by(user_id=USER_ID, isin=ISIN), "uq_user_tracking_user_isin"),
+    ("UserTracking по user_id (subscription_utils)",
+     select(UserTracking).where(UserTracking.user_id == USER_ID), "uq_user_tracking_user_isin"),
+    ("Портфель: JOIN users -> user_tracking (/list, /events)",
+     portfolio_query(USER_ID), "uq_user_tracking_user_isin"),
+    ("Портфель: JOIN user_tracking -> bonds_database (/list, /events)",
+     portfolio_query(USER_ID), "bonds_database_isin_key"),
+    ("Ближайшие события портфеля: bond_events по isin (/events)",
+     upcoming_events_query(USER_ID, date(2026, 1, 1)), "uq_bond_event"),
+    ("Subscription по user_id (handlers, subscription_utils)",
+     select(Subscription).filter_by(user_id=USER_ID), "ix_subscriptions_user_id"),
+    ("Истёкшие подписки (check_subscriptions)",
+     select(Subscription).where(Subscription.is_subscribed == True, Subscription.subscription_end < datetime(2026, 1, 1)),
+     "ix_subscriptions_active_end"),
+    ("Уведомление по событию (notification)",
+     select(UserNotification).filter_by(user_id=USER_ID, bond_isin=ISIN, event_type="coupon",
+                                        event_date=datetime(2026, 1, 1)),
+     "uq_user_notification_event"),
+    ("Доставленные уведомления по outbox_id (notification_outbox)",
+     update(UserNotification).where(UserNotification.outbox_id.in_([1, 2, 3])).values(is_sent=True),
+     "ix_user_notifications_outbox_id"),
+    ("События по типу и дате (планировщик уведомлений)",
+     due_events_query("coupon", date(2026, 1, 1)), "ix_bond_events_type_date"),
+    ("JOIN bond_events -> user_tracking по isin (планировщик уведомлений)",
+     due_events_query("coupon", date(2026, 1, 1)), "ix_user_tracking_isin"),
+    ("Готовые к отправке сообщения outbox",
+     select(NotificationOutbox.id).where(NotificationOutbox.status.in_(("pending", "sending")),
+                                         NotificationOutbox.next_attempt_at <= datetime(2026, 1, 1)),
+     "ix_notification_outbox_due"),
+]
+
+
+def plan_indexes(node: dict) -> set[str]:
+    found = {node["Index Name"]} if "Index Name" in node else set()
+    for child in node.get("Plans", []):
+        found |= plan_indexes(child)
+    return found
+
+
+async def main() -> int:
+    failed = 0
+    async with get_session() as session:
+        await session.execute(text("SET enable_seqscan = off"))
+        for title, statement, index in CHECKS:
+            sql = statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+            result = await session.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))
+            plan = result.scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            used = plan_indexes(plan[0]["Plan"])
+            ok = index in used
+            failed += not ok
+            print(f"{'✅' if ok else '❌'} {title}: ожидается {index}, в плане {sorted(used) or 'нет индексов'}")
+        await session.rollback()
+    await engine.dispose()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,104 @@
+# database/engine.py
+import logging
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from config import (
+    DATABASE_URL,
+    DB_ECHO,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING,
+    DB_PREPARED_STATEMENT_CACHE_SIZE,
+    DB_STATEMENT_TIMEOUT_MS,
+    DB_COMMAND_TIMEOUT,
+)
+
+logger = logging.getLogger("db_engine")
+
+
+class InstrumentedAsyncPool(AsyncAdaptedQueuePool):
+    """Пул соединений, который считает выдачи, время ожидания соединения и таймауты."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            self.checkouts += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "checked_in": self.checkedin(),
+            "overflow": self.overflow(),
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": round(self.wait_seconds / self.checkouts * 1000, 2) if self.checkouts else 0.0,
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 2),
+        }
+
+
+def build_engine(url: str = DATABASE_URL) -> AsyncEngine:
+    """
+    Async-движок по настройкам из config: размер пула, overflow, таймаут ожидания,
+    recycle, pre-ping, кэш подготовленных выражений asyncpg и statement_timeout.
+    """
+    db_url = make_url(url)
+    if db_url.drivername == "postgresql+asyncpg":
+        db_url = db_url.update_query_dict({"prepared_statement_cache_size": str(DB_PREPARED_STATEMENT_CACHE_SIZE)})
+
+    connect_args = {}
+    if db_url.drivername == "postgresql+asyncpg":
+        connect_args = {
+            "command_timeout": DB_COMMAND_TIMEOUT,
+            "server_settings": {
+                "statement_timeout": str(DB_STATEMENT_TIMEOUT_MS),
+                "application_name": "bondwatch",
+            },
+        }
+
+    engine = create_async_engine(
+        db_url,
+        echo=DB_ECHO,
+        poolclass=InstrumentedAsyncPool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+    logger.info(
+        f"DB engine: pool_size={DB_POOL_SIZE}, max_overflow={DB_MAX_OVERFLOW}, "
+        f"pool_timeout={DB_POOL_TIMEOUT}s, statement_timeout={DB_STATEMENT_TIMEOUT_MS}ms, echo={DB_ECHO}"
+    )
+    return engine
+
+
+def pool_stats(engine: AsyncEngine) -> dict:
+    """Текущее состояние пула: занятые соединения, overflow, ожидание выдачи."""
+    pool = engine.sync_engine.pool
+    if isinstance(pool, InstrumentedAsyncPool):
+        return pool.stats()
+    return {"status": pool.status()}
@@ -0,0 +1,250 @@
+# database.portfolio.py
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, date
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import PORTFOLIO_CACHE_MAX_USERS, PORTFOLIO_EPOCH_CHECK_SECONDS
+from database.db import get_session, User, UserTracking, BondsDatabase, BondEvent, DataEpoch
+
+logger = logging.getLogger("portfolio")
+
+# Строка data_epochs для данных облигаций
+BONDS_EPOCH = "bonds"
+
+
+class PortfolioUser(NamedTuple):
+    tg_id: int
+    full_name: Optional[str]
+
+
+class PortfolioTracking(NamedTuple):
+    """Строка user_tracking: только колонки, которые нужны просмотру портфеля."""
+    id: int
+    isin: str
+    quantity: int
+    added_at: Optional[datetime]
+
+
+class PortfolioBond(NamedTuple):
+    isin: str
+    name: Optional[str]
+
+
+class Holding(NamedTuple):
+    """Бумага в портфеле пользователя: запись отслеживания и сама облигация."""
+    tracking: PortfolioTracking
+    bond: PortfolioBond
+
+
+class Portfolio(NamedTuple):
+    user: PortfolioUser
+    holdings: tuple[Holding, ...]
+    version: int = 0  # Номер снимка в кэше: новый после каждого изменения портфеля
+    epoch: int = 0  # Эпоха данных облигаций, на которой снимок загружен
+
+
+class UpcomingEvent(NamedTuple):
+    event_date: date
+    amount: Optional[float]
+
+
+class PortfolioCache:
+    """
+    Кэш портфелей в памяти процесса, ключ — tg_id, LRU по числу пользователей.
+    Снимок действителен, пока пользователь не изменил портфель (bump_version)
+    и не сменилась эпоха данных облигаций (set_epoch). Эпоха хранится в БД (data_epochs),
+    поэтому сверка в другом процессе тоже сбрасывает кэш — с задержкой до PORTFOLIO_EPOCH_CHECK_SECONDS.
+    Снимок общий для всех читателей, поэтому в нём неизменяемые строки (NamedTuple), а не ORM-объекты:
+    его нельзя случайно изменить или привязать к чужой сессии.
+    """
+
+    def __init__(self, max_users: int = PORTFOLIO_CACHE_MAX_USERS):
+        self.max_users = max_users
+        self.epoch = 0
+        self.epoch_checked_at = float("-inf")  # monotonic-время последней сверки эпохи с БД
+        self._entries: OrderedDict[int, Portfolio] = OrderedDict()
+        self._next_version = 0
+        # Счётчик изменений: снимок, загрузка которого пересеклась с изменением, не кэшируется
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, tg_id: int) -> Optional[Portfolio]:
+        portfolio = self._entries.get(tg_id)
+        if portfolio is None or portfolio.epoch != self.epoch:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(tg_id)
+        self.hits += 1
+        return portfolio
+
+    def generation(self) -> int:
+        return self._generation
+
+    def put(self, tg_id: int, portfolio: Portfolio, generation: int) -> Portfolio:
+        self._next_version += 1
+        portfolio = portfolio._replace(version=self._next_version, epoch=self.epoch)
+        if generation != self._generation:
+            return portfolio
+        self._entries[tg_id] = portfolio
+        self._entries.move_to_end(tg_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return portfolio
+
+    def bump_version(self, tg_id: int):
+        self._generation += 1
+        if self._entries.pop(tg_id, None) is not None:
+            self.invalidations += 1
+
+    def bump_holders(self, isin: str):
+        """Сбрасывает снимки портфелей, в которых есть бумага isin."""
+        self._generation += 1
+        holders = [tg_id for tg_id, portfolio in self._entries.items()
+                   if any(holding.bond.isin == isin for holding in portfolio.holdings)]
+        for tg_id in holders:
+            del self._entries[tg_id]
+        self.invalidations += len(holders)
+
+    def set_epoch(self, epoch: int):
+        self.epoch_checked_at = time.monotonic()
+        if epoch != self.epoch:
+            self._generation += 1
+            self.epoch = epoch
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "epoch": self.epoch,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+_cache = PortfolioCache()
+
+
+def bump_portfolio_version(tg_id: int):
+    """Портфель пользователя изменился (добавление, удаление, количество)."""
+    _cache.bump_version(tg_id)
+
+
+def bump_bond_holders(isin: str):
+    """Изменились данные одной облигации: устаревают только портфели, где она есть."""
+    _cache.bump_holders(isin)
+
+
+async def bump_data_epoch():
+    """
+    Данные облигаций изменились для всех: увеличивает эпоху в data_epochs,
+    снимки портфелей устаревают во всех процессах.
+    """
+    now = datetime.utcnow()
+    stmt = pg_insert(DataEpoch).values(name=BONDS_EPOCH, epoch=1, updated_at=now)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["name"],
+        set_={"epoch": DataEpoch.epoch + 1, "updated_at": now},
+    ).returning(DataEpoch.epoch)
+    try:
+        async with get_session() as session:
+            epoch = (await session.execute(stmt)).scalar_one()
+            await session.commit()
+    except Exception as e:
+        # Свой кэш сбрасываем в любом случае; при следующей сверке эпоха вернётся к значению из БД
+        logger.error(f"❌ Не удалось обновить эпоху данных облигаций: {e}")
+        epoch = _cache.epoch + 1
+    _cache.set_epoch(epoch)
+
+
+async def sync_data_epoch(session: AsyncSession):
+    """Сверяет эпоху с БД не чаще раза в PORTFOLIO_EPOCH_CHECK_SECONDS."""
+    if time.monotonic() - _cache.epoch_checked_at < PORTFOLIO_EPOCH_CHECK_SECONDS:
+        return
+    epoch = await session.scalar(select(DataEpoch.epoch).where(DataEpoch.name == BONDS_EPOCH))
+    _cache.set_epoch(epoch or 0)
+
+
+def portfolio_cache_stats() -> dict:
+    return _cache.stats()
+
+
+def portfolio_query(tg_id: int):
+    """
+    users ⟕ user_tracking ⟕ bonds_database одним запросом, только нужные колонки.
+    LEFT JOIN, чтобы пользователь без бумаг тоже вернулся (одна строка с NULL вместо отслеживания).
+    """
+    return (
+        select(
+            User.tg_id, User.full_name,
+            UserTracking.id.label("tracking_id"), UserTracking.quantity, UserTracking.added_at,
+            BondsDatabase.isin, BondsDatabase.name,
+        )
+        .outerjoin(UserTracking, UserTracking.user_id == User.tg_id)
+        .outerjoin(BondsDatabase, BondsDatabase.isin == UserTracking.isin)
+        .where(User.tg_id == tg_id)
+        .order_by(UserTracking.id)
+    )
+
+
+async def load_portfolio(session: AsyncSession, tg_id: int) -> Optional[Portfolio]:
+    """
+    Пользователь и все его бумаги с данными облигаций за один запрос к БД,
+    вместо selectinload(User.tracked_bonds) и отдельного select по каждому ISIN.
+    Повторные просмотры отдаются из кэша: к БД — только сверка эпохи раз в PORTFOLIO_EPOCH_CHECK_SECONDS.
+    None — пользователь не зарегистрирован.
+    """
+    await sync_data_epoch(session)
+    if (cached := _cache.get(tg_id)) is not None:
+        return cached
+
+    generation = _cache.generation()
+    result = await session.execute(portfolio_query(tg_id))
+    rows = result.all()
+    if not rows:
+        return None
+
+    holdings = tuple(
+        Holding(PortfolioTracking(row.tracking_id, row.isin, row.quantity, row.added_at),
+                PortfolioBond(row.isin, row.name))
+        for row in rows if row.tracking_id is not None and row.isin is not None
+    )
+    user = PortfolioUser(rows[0].tg_id, rows[0].full_name)
+    return _cache.put(tg_id, Portfolio(user, holdings), generation)
+
+
+def upcoming_events_query(tg_id: int, today: date):
+    """
+    Ближайшее событие каждого типа по бумагам пользователя из bond_events:
+    user_tracking ⋈ bond_events, DISTINCT ON (isin, event_type) по возрастанию даты.
+    """
+    return (
+        select(BondEvent.isin, BondEvent.event_type, BondEvent.event_date, BondEvent.amount)
+        .join(UserTracking, UserTracking.isin == BondEvent.isin)
+        .where(UserTracking.user_id == tg_id, BondEvent.event_date >= today)
+        .distinct(BondEvent.isin, BondEvent.event_type)
+        .order_by(BondEvent.isin, BondEvent.event_type, BondEvent.event_date)
+    )
+
+
+async def load_upcoming_events(session: AsyncSession, tg_id: int,
+                               today: date) -> dict[str, dict[str, UpcomingEvent]]:
+    """{isin: {тип события: ближайшее событие}} по портфелю пользователя одним запросом."""
+    result = await session.execute(upcoming_events_query(tg_id, today))
+    events: dict[str, dict[str, UpcomingEvent]] = {}
+    for row in result:
+        events.setdefault(row.isin, {})[row.event_type] = UpcomingEvent(row.event_date, row.amount)
+    return events
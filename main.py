@@ -13,9 +13,15 @@ from yookassa import Webhook, Payment, Configuration
 
 from config import TELEGRAM_TOKEN
 from bot.handlers import register_handlers
+from bot.render_cache import events_text_cache
+from bot.send_dispatcher import get_send_dispatcher
 from database.db import init_db, get_session, Subscription
+from database.portfolio import portfolio_cache_stats
 from notification import check_and_notify_all
+from notification_outbox import run_outbox_worker
 from bonds_get.nightly_sync import perform_nightly_sync
+from bonds_get.name_backfill import run_name_backfill_worker
+from bonds_get.moex_client import start_moex_client, close_moex_client
 
 # Настройка кодировки и логирования
 sys.stdout = io.TextIOWrapper(sys.stdout.detach(), encoding='utf-8', errors='ignore')
@@ -104,6 +110,7 @@ async def main():
     # Инициализация БД
     logging.info("Initializing database...")
     await init_db()
+    await start_moex_client()
 
     # Создание приложения бота
     logging.info("Starting bot...")
@@ -134,6 +141,9 @@ async def main():
     # Инициализация и запуск бота
     await app_bot.initialize()
     await app_bot.start()
+    send_dispatcher = get_send_dispatcher(app_bot)
+    outbox_worker = asyncio.create_task(run_outbox_worker(app_bot))
+    name_backfill_worker = asyncio.create_task(run_name_backfill_worker())
 
     # Запуск веб-сервера
     await start_web(app_web)
@@ -148,8 +158,14 @@ async def main():
         pass
     finally:
         # Корректное завершение работы
+        outbox_worker.cancel()
+        name_backfill_worker.cancel()
+        await asyncio.gather(outbox_worker, name_backfill_worker, return_exceptions=True)
+        await send_dispatcher.stop()
         await app_bot.stop()
         await app_bot.shutdown()
+        await close_moex_client()
+        logger.info(f"📊 Кэш портфелей: {portfolio_cache_stats()}, кэш /events: {events_text_cache.stats()}")
 
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -2,6 +2,7 @@
 import asyncio
 import logging
 from bonds_get.nightly_sync import perform_nightly_sync
+from bonds_get.moex_client import start_moex_client, close_moex_client
 
 # Настройка логирования
 logging.basicConfig(
@@ -11,7 +12,11 @@ logging.basicConfig(
 
 
 async def main():
-    await perform_nightly_sync()
+    await start_moex_client()
+    try:
+        await perform_nightly_sync()
+    finally:
+        await close_moex_client()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,52 @@
+# migrations/env.py
+import asyncio
+from logging.config import fileConfig
+
+from alembic import context
+
+from config import DATABASE_URL
+from database.db import Base
+from database.engine import build_engine
+
+config = context.config
+shared_connection = config.attributes.get("connection")
+
+# При запуске из init_db логирование уже настроено ботом
+if config.config_file_name is not None and shared_connection is None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+
+def run_migrations_offline():
+    """alembic upgrade --sql: SQL-скрипт без подключения к БД."""
+    context.configure(
+        url=DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def do_run_migrations(connection):
+    context.configure(connection=connection, target_metadata=target_metadata, compare_type=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_async_migrations():
+    engine = build_engine()
+    async with engine.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+        await connection.commit()
+    await engine.dispose()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+elif shared_connection is not None:
+    do_run_migrations(shared_connection)
+else:
+    asyncio.run(run_async_migrations())
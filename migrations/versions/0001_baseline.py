@@ -0,0 +1,187 @@
+"""baseline schema
+
+Схема на момент перехода на Alembic. Базы, созданные раньше через create_all,
+доводятся до неё: недостающие таблицы создаются, колонки и индексы добавляются
+идемпотентно.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# Бывшие UPGRADE_STATEMENTS из database/db.py для баз, созданных create_all
+LEGACY_UPGRADES = [
+    """
+    DELETE FROM user_notifications a USING user_notifications b
+    WHERE a.id > b.id
+      AND a.user_id = b.user_id
+      AND a.bond_isin = b.bond_isin
+      AND a.event_type = b.event_type
+      AND a.event_date = b.event_date
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_user_notification_event
+    ON user_notifications (user_id, bond_isin, event_type, event_date)
+    """,
+    """
+    ALTER TABLE user_notifications
+    ADD COLUMN IF NOT EXISTS outbox_id INTEGER REFERENCES notification_outbox (id)
+    """,
+    """
+    ALTER TABLE bonds_database
+    ADD COLUMN IF NOT EXISTS schedule_fetched_at TIMESTAMP
+    """,
+    """
+    ALTER TABLE bonds_database
+    ADD COLUMN IF NOT EXISTS payload_hash VARCHAR(64)
+    """,
+]
+
+
+def upgrade():
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    legacy = "users" in existing
+
+    def create_table(name, *columns):
+        if name not in existing:
+            op.create_table(name, *columns)
+
+    create_table(
+        "users",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("tg_id", sa.BigInteger),
+        sa.Column("full_name", sa.String(255)),
+    )
+    op.create_index("ix_users_tg_id", "users", ["tg_id"], unique=True, if_not_exists=True)
+
+    create_table(
+        "subscriptions",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("user_id", sa.BigInteger, sa.ForeignKey("users.tg_id")),
+        sa.Column("is_subscribed", sa.Boolean),
+        sa.Column("subscription_start", sa.TIMESTAMP, nullable=True),
+        sa.Column("subscription_end", sa.TIMESTAMP, nullable=True),
+        sa.Column("payment_status", sa.String, nullable=True),
+        sa.Column("payment_date", sa.TIMESTAMP, nullable=True),
+        sa.Column("payment_amount", sa.Float, nullable=True),
+        sa.Column("plan", sa.String, nullable=True),
+        sa.Column("pending_payment_id", sa.String),
+        sa.Column("payment_method_id", sa.String),
+        sa.Column("auto_renew", sa.Boolean),
+    )
+
+    create_table(
+        "bonds_database",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("isin", sa.String, nullable=False, unique=True),
+        sa.Column("name", sa.String),
+        sa.Column("figi", sa.String, nullable=True),
+        sa.Column("class_code", sa.String, nullable=True),
+        sa.Column("ticker", sa.String, nullable=True),
+        sa.Column("added_at", sa.TIMESTAMP),
+        sa.Column("last_updated", sa.TIMESTAMP),
+        sa.Column("next_coupon_date", sa.Date, nullable=True),
+        sa.Column("next_coupon_value", sa.Float, nullable=True),
+        sa.Column("offer_date", sa.Date, nullable=True),
+        sa.Column("amortization_date", sa.Date, nullable=True),
+        sa.Column("amortization_value", sa.Float, nullable=True),
+        sa.Column("maturity_date", sa.Date, nullable=True),
+        sa.Column("schedule_fetched_at", sa.TIMESTAMP, nullable=True),
+        sa.Column("payload_hash", sa.String(64), nullable=True),
+    )
+
+    create_table(
+        "bond_events",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("isin", sa.String, sa.ForeignKey("bonds_database.isin"), nullable=False),
+        sa.Column("event_type", sa.String(16), nullable=False),
+        sa.Column("event_date", sa.Date, nullable=False),
+        sa.Column("amount", sa.Float, nullable=True),
+        sa.UniqueConstraint("isin", "event_type", "event_date", name="uq_bond_event"),
+    )
+    op.create_index("ix_bond_events_event_date", "bond_events", ["event_date"], if_not_exists=True)
+
+    create_table(
+        "bond_coupons",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("isin", sa.String, sa.ForeignKey("bonds_database.isin"), nullable=False),
+        sa.Column("coupon_date", sa.Date, nullable=False),
+        sa.Column("value", sa.Float, nullable=True),
+        sa.Column("percent", sa.Float, nullable=True),
+        sa.UniqueConstraint("isin", "coupon_date", name="uq_bond_coupon"),
+    )
+
+    create_table(
+        "bond_amortizations",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("isin", sa.String, sa.ForeignKey("bonds_database.isin"), nullable=False),
+        sa.Column("amort_date", sa.Date, nullable=False),
+        sa.Column("value", sa.Float, nullable=True),
+        sa.Column("data_source", sa.String, nullable=False),
+        sa.UniqueConstraint("isin", "amort_date", "data_source", name="uq_bond_amortization"),
+    )
+
+    create_table(
+        "bond_offers",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("isin", sa.String, sa.ForeignKey("bonds_database.isin"), nullable=False),
+        sa.Column("offer_date", sa.Date, nullable=False),
+        sa.Column("offer_type", sa.String, nullable=False),
+        sa.UniqueConstraint("isin", "offer_date", "offer_type", name="uq_bond_offer"),
+    )
+
+    create_table(
+        "user_tracking",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("user_id", sa.BigInteger, sa.ForeignKey("users.tg_id"), nullable=False),
+        sa.Column("isin", sa.String, sa.ForeignKey("bonds_database.isin"), nullable=False),
+        sa.Column("quantity", sa.Integer, nullable=False),
+        sa.Column("added_at", sa.TIMESTAMP),
+    )
+
+    create_table(
+        "notification_outbox",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("user_id", sa.BigInteger, sa.ForeignKey("users.tg_id"), nullable=False),
+        sa.Column("message", sa.Text, nullable=False),
+        sa.Column("status", sa.String(16), nullable=False),
+        sa.Column("attempts", sa.Integer, nullable=False),
+        sa.Column("next_attempt_at", sa.TIMESTAMP, nullable=False),
+        sa.Column("last_error", sa.String, nullable=True),
+        sa.Column("created_at", sa.TIMESTAMP),
+        sa.Column("sent_at", sa.TIMESTAMP, nullable=True),
+    )
+    op.create_index("ix_notification_outbox_due", "notification_outbox", ["status", "next_attempt_at"],
+                    if_not_exists=True)
+
+    create_table(
+        "user_notifications",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("user_id", sa.BigInteger, sa.ForeignKey("users.tg_id"), nullable=False),
+        sa.Column("bond_isin", sa.String, sa.ForeignKey("bonds_database.isin"), nullable=False),
+        sa.Column("event_type", sa.String, nullable=False),
+        sa.Column("event_date", sa.TIMESTAMP, nullable=False),
+        sa.Column("is_sent", sa.Boolean),
+        sa.Column("sent_at", sa.TIMESTAMP),
+        sa.Column("days_left", sa.Integer),
+        sa.Column("outbox_id", sa.Integer, sa.ForeignKey("notification_outbox.id"), nullable=True),
+        sa.UniqueConstraint("user_id", "bond_isin", "event_type", "event_date", name="uq_user_notification_event"),
+    )
+
+    if legacy:
+        for statement in LEGACY_UPGRADES:
+            op.execute(statement)
+
+
+def downgrade():
+    for table in ("user_notifications", "notification_outbox", "user_tracking", "bond_offers",
+                  "bond_amortizations", "bond_coupons", "bond_events", "bonds_database",
+                  "subscriptions", "users"):
+        op.drop_table(table)
@@ -0,0 +1,82 @@
+"""indexes for handler, subscription and notification queries
+
+- user_tracking: уникальная пара (user_id, isin) для filter_by(user_id=..., isin=...)
+  и индекс по isin для JOIN из bond_events в планировщике уведомлений;
+- subscriptions: индекс по user_id и частичный индекс активных подписок по сроку окончания;
+- user_notifications: индекс по outbox_id для отметки доставленных сообщений;
+- bond_events: (event_type, event_date) вместо одиночного event_date — так фильтрует планировщик.
+
+Проверка использования индексов: python check_indexes.py
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Повторные записи одной бумаги у пользователя сливаются в самую раннюю, количества суммируются
+    duplicates = op.get_bind().execute(sa.text(
+        """
+        SELECT user_id, isin, min(id) AS kept_id, count(*) AS records, sum(quantity) AS quantity
+        FROM user_tracking
+        GROUP BY user_id, isin
+        HAVING count(*) > 1
+        """
+    )).all()
+    for row in duplicates:
+        logger.warning(f"user_tracking: {row.records} записи {row.isin} у {row.user_id} слиты в id={row.kept_id}, "
+                       f"количество {row.quantity}")
+    op.execute(
+        """
+        UPDATE user_tracking t
+        SET quantity = d.quantity
+        FROM (
+            SELECT user_id, isin, min(id) AS kept_id, sum(quantity) AS quantity
+            FROM user_tracking
+            GROUP BY user_id, isin
+            HAVING count(*) > 1
+        ) d
+        WHERE t.id = d.kept_id
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM user_tracking a USING user_tracking b
+        WHERE a.id > b.id
+          AND a.user_id = b.user_id
+          AND a.isin = b.isin
+        """
+    )
+    op.create_unique_constraint("uq_user_tracking_user_isin", "user_tracking", ["user_id", "isin"])
+    op.create_index("ix_user_tracking_isin", "user_tracking", ["isin"])
+
+    op.create_index("ix_subscriptions_user_id", "subscriptions", ["user_id"])
+    op.create_index("ix_subscriptions_active_end", "subscriptions", ["subscription_end"],
+                    postgresql_where=sa.text("is_subscribed"))
+
+    op.create_index("ix_user_notifications_outbox_id", "user_notifications", ["outbox_id"])
+
+    op.create_index("ix_bond_events_type_date", "bond_events", ["event_type", "event_date"])
+    op.drop_index("ix_bond_events_event_date", table_name="bond_events")
+
+
+def downgrade():
+    op.create_index("ix_bond_events_event_date", "bond_events", ["event_date"])
+    op.drop_index("ix_bond_events_type_date", table_name="bond_events")
+    op.drop_index("ix_user_notifications_outbox_id", table_name="user_notifications")
+    op.drop_index("ix_subscriptions_active_end", table_name="subscriptions")
+    op.drop_index("ix_subscriptions_user_id", table_name="subscriptions")
+    op.drop_index("ix_user_tracking_isin", table_name="user_tracking")
+    op.drop_constraint("uq_user_tracking_user_isin", "user_tracking", type_="unique")
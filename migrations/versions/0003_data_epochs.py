@@ -0,0 +1,29 @@
+"""data_epochs: shared epoch counters for in-process caches
+
+Ночная сверка (в том числе manual_sync.py в отдельном процессе) увеличивает эпоху
+данных облигаций, бот сверяет её и сбрасывает кэш портфелей.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "data_epochs",
+        sa.Column("name", sa.String(32), primary_key=True),
+        sa.Column("epoch", sa.BigInteger, nullable=False),
+        sa.Column("updated_at", sa.TIMESTAMP),
+    )
+
+
+def downgrade():
+    op.drop_table("data_epochs")
@@ -0,0 +1,227 @@
+# moex_stub/catalog.py
+"""
+Каталог облигаций для локальной заглушки MOEX ISS: записанные ответы (корпус) и
+синтетические бумаги, которые детерминированно генерируются по ISIN.
+
+Корпус — каталог с файлами:
+    securities/{ISIN}.json   — ответ /securities/{isin}.json
+    bondization/{ISIN}.json  — bondization.json со всеми строками таблиц (без пагинации)
+
+Генерация синтетического корпуса и заполнение bonds_database для бенчмарка синхронизации:
+    python -m moex_stub.catalog --count 10000 --out fixtures/moex_synthetic
+    python -m moex_stub.catalog --count 10000 --seed-db
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import zlib
+from collections import OrderedDict
+from datetime import date, timedelta
+from functools import lru_cache
+from pathlib import Path
+
+logger = logging.getLogger("moex_stub.catalog")
+
+SYNTHETIC_PREFIX = "RU000Z"
+# Разобранных ответов в памяти у одного каталога
+CATALOG_CACHE_SIZE = 4096
+# ISIN — 12 символов: префикс, 5 цифр номера и контрольная цифра
+SYNTHETIC_MAX_COUNT = 100_000
+
+DESCRIPTION_COLUMNS = ["name", "title", "value", "type", "sort_order", "is_hidden", "precision"]
+COUPON_COLUMNS = ["isin", "name", "issuevalue", "coupondate", "recorddate", "startdate", "initialfacevalue",
+                  "facevalue", "faceunit", "value", "valueprc", "value_rub", "secid", "primary_boardid"]
+AMORTIZATION_COLUMNS = ["isin", "name", "issuevalue", "amortdate", "facevalue", "initialfacevalue", "faceunit",
+                        "valueprc", "value", "value_rub", "data_source", "secid", "primary_boardid"]
+OFFER_COLUMNS = ["isin", "name", "issuevalue", "offerdate", "offerdatestart", "offerdateend", "facevalue",
+                 "faceunit", "price", "value", "agent", "offertype", "secid", "primary_boardid"]
+
+ISSUERS = ["Газпром капитал", "РЖД", "Сбербанк", "ВТБ", "Ростелеком", "МТС", "Роснефть", "Минфин РФ",
+           "Сегежа", "Магнит", "ЛСР", "Самолет", "Металлоинвест", "АФК Система", "Акрон"]
+
+
+def synthetic_isin(number: int) -> str:
+    if not 0 <= number < SYNTHETIC_MAX_COUNT:
+        raise ValueError(f"Номер синтетической облигации вне диапазона 0..{SYNTHETIC_MAX_COUNT - 1}: {number}")
+    return f"{SYNTHETIC_PREFIX}{number:05d}{number % 10}"
+
+
+def synthetic_isins(count: int) -> list[str]:
+    return [synthetic_isin(i) for i in range(count)]
+
+
+def synthetic_count(raw: str) -> int:
+    """Тип аргумента --count/--synthetic: не больше SYNTHETIC_MAX_COUNT облигаций."""
+    count = int(raw)
+    if not 0 <= count <= SYNTHETIC_MAX_COUNT:
+        raise argparse.ArgumentTypeError(f"допустимо от 0 до {SYNTHETIC_MAX_COUNT} облигаций")
+    return count
+
+
+def _add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    year = day.year + month // 12
+    month = month % 12 + 1
+    return date(year, month, min(day.day, 28))
+
+
+@lru_cache(maxsize=4096)
+def synthetic_bond(isin: str) -> tuple[dict, dict]:
+    """
+    (securities.json, bondization.json) для синтетической бумаги. Параметры выпуска
+    зависят только от ISIN: срок до 30 лет, 2/4/12 купонов в год, часть бумаг с
+    амортизацией и офертами.
+    """
+    rng = random.Random(zlib.crc32(isin.encode()))
+    issuer = rng.choice(ISSUERS)
+    series = rng.randint(1, 40)
+    name = f"{issuer} БО-{series:02d}"
+    issue_date = date(2012, 1, 1) + timedelta(days=rng.randint(0, 13 * 365))
+    per_year = rng.choice((2, 4, 4, 12))
+    periods = rng.randint(1, 30) * per_year
+    step = 12 // per_year
+    face = 1000.0
+    rate = round(rng.uniform(6, 22), 2)
+    coupon_value = round(face * rate / 100 / per_year, 2)
+
+    dates = [_add_months(issue_date, step * (i + 1)) for i in range(periods)]
+    maturity = dates[-1]
+
+    coupons = []
+    amortizations = []
+    amortizing = periods >= 8 and rng.random() < 0.3
+    amort_parts = min(periods // 2, rng.randint(4, 20)) if amortizing else 0
+    outstanding = face
+    for i, day in enumerate(dates):
+        coupons.append([isin, name, 1_000_000_000, day.isoformat(), (day - timedelta(days=1)).isoformat(),
+                        (day - timedelta(days=30 * step)).isoformat(), face, outstanding, "SUR",
+                        round(outstanding * rate / 100 / per_year, 2) if amortizing else coupon_value,
+                        rate, coupon_value, isin, "TQCB"])
+        if amortizing and i >= periods - amort_parts:
+            part = round(face / amort_parts, 2)
+            outstanding = round(outstanding - part, 2)
+            source = "maturity" if i == periods - 1 else "amortization"
+            amortizations.append([isin, name, 1_000_000_000, day.isoformat(), face, face, "SUR",
+                                  round(100 / amort_parts, 2), part, part, source, isin, "TQCB"])
+    if not amortizing:
+        amortizations.append([isin, name, 1_000_000_000, maturity.isoformat(), face, face, "SUR",
+                              100, face, face, "maturity", isin, "TQCB"])
+
+    offers = []
+    if periods > per_year * 3 and rng.random() < 0.2:
+        for years in range(3, periods // per_year, 3):
+            offer_date = _add_months(issue_date, 12 * years)
+            offer_type = "Оферта (Put)" if rng.random() < 0.85 else "Оферта отменена"
+            offers.append([isin, name, 1_000_000_000, offer_date.isoformat(),
+                           (offer_date - timedelta(days=14)).isoformat(),
+                           (offer_date - timedelta(days=7)).isoformat(),
+                           face, "SUR", 100, face, "Агент", offer_type, isin, "TQCB"])
+
+    securities = {"description": {"columns": DESCRIPTION_COLUMNS, "data": [
+        ["SECID", "Код ценной бумаги", isin, "string", 1, 0, None],
+        ["NAME", "Полное наименование", f"{issuer} облигации серии БО-{series:02d}", "string", 2, 0, None],
+        ["SHORTNAME", "Краткое наименование", name, "string", 3, 0, None],
+        ["ISIN", "ISIN код", isin, "string", 4, 0, None],
+        ["ISSUEDATE", "Дата начала торгов", issue_date.isoformat(), "date", 5, 0, None],
+        ["MATDATE", "Дата погашения", maturity.isoformat(), "date", 6, 0, None],
+        ["FACEVALUE", "Номинальная стоимость", str(face), "number", 7, 0, 2],
+        ["COUPONFREQUENCY", "Периодичность выплаты купона в год", str(per_year), "number", 8, 0, None],
+        ["GROUP", "Код типа инструмента", "stock_bonds", "string", 9, 0, None],
+    ]}}
+    bondization = {
+        "amortizations": {"columns": AMORTIZATION_COLUMNS, "data": amortizations},
+        "coupons": {"columns": COUPON_COLUMNS, "data": coupons},
+        "offers": {"columns": OFFER_COLUMNS, "data": offers},
+    }
+    return securities, bondization
+
+
+class Catalog:
+    """Источник ответов заглушки: сначала записанный корпус, затем синтетические бумаги."""
+
+    def __init__(self, corpus: Path | None = None, synthetic_count: int = 0):
+        self.corpus = corpus
+        self.synthetic_count = synthetic_count
+        self._recorded: list[str] = []
+        if corpus is not None:
+            self._recorded = sorted(p.stem for p in (corpus / "bondization").glob("*.json"))
+        self._synthetic = set(synthetic_isins(synthetic_count))
+        self._loaded: OrderedDict[tuple[str, str], dict | None] = OrderedDict()
+
+    def isins(self) -> list[str]:
+        return self._recorded + synthetic_isins(self.synthetic_count)
+
+    def _load(self, kind: str, isin: str) -> dict | None:
+        key = (kind, isin)
+        if key in self._loaded:
+            self._loaded.move_to_end(key)
+            return self._loaded[key]
+        data = self._read(kind, isin)
+        self._loaded[key] = data
+        if len(self._loaded) > CATALOG_CACHE_SIZE:
+            self._loaded.popitem(last=False)
+        return data
+
+    def _read(self, kind: str, isin: str) -> dict | None:
+        if self.corpus is not None:
+            path = self.corpus / kind / f"{isin}.json"
+            if path.exists():
+                return json.loads(path.read_text(encoding="utf-8"))
+        if isin in self._synthetic:
+            securities, bondization = synthetic_bond(isin)
+            return securities if kind == "securities" else bondization
+        return None
+
+    def securities(self, isin: str) -> dict | None:
+        return self._load("securities", isin)
+
+    def bondization(self, isin: str) -> dict | None:
+        return self._load("bondization", isin)
+
+
+def write_corpus(out: Path, count: int):
+    """Сохраняет синтетический каталог в формате корпуса."""
+    (out / "securities").mkdir(parents=True, exist_ok=True)
+    (out / "bondization").mkdir(parents=True, exist_ok=True)
+    for isin in synthetic_isins(count):
+        securities, bondization = synthetic_bond(isin)
+        (out / "securities" / f"{isin}.json").write_text(json.dumps(securities, ensure_ascii=False), encoding="utf-8")
+        (out / "bondization" / f"{isin}.json").write_text(json.dumps(bondization, ensure_ascii=False), encoding="utf-8")
+    logger.info(f"💾 Синтетический корпус: {count} облигаций в {out}")
+
+
+async def seed_database(isins: list[str], batch_size: int = 1000):
+    """Добавляет ISIN в bonds_database, чтобы ночной синк работал по всему каталогу."""
+    from sqlalchemy.dialects.postgresql import insert as pg_insert
+    from database.db import init_db, get_session, BondsDatabase
+
+    await init_db()
+    for i in range(0, len(isins), batch_size):
+        async with get_session() as session:
+            await session.execute(
+                pg_insert(BondsDatabase)
+                .values([{"isin": isin} for isin in isins[i:i + batch_size]])
+                .on_conflict_do_nothing(index_elements=["isin"])
+            )
+            await session.commit()
+    logger.info(f"🗄 В bonds_database добавлено до {len(isins)} облигаций")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Синтетический каталог облигаций для заглушки MOEX")
+    parser.add_argument("--count", type=synthetic_count, default=10_000)
+    parser.add_argument("--out", type=Path, help="Каталог для записи корпуса")
+    parser.add_argument("--seed-db", action="store_true", help="Добавить ISIN каталога в bonds_database")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.out:
+        write_corpus(args.out, args.count)
+    if args.seed_db:
+        asyncio.run(seed_database(synthetic_isins(args.count)))
+
+
+if __name__ == "__main__":
+    main()
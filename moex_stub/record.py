@@ -0,0 +1,87 @@
+# moex_stub/record.py
+"""
+Записывает ответы MOEX ISS в корпус для заглушки (полные таблицы bondization, без пагинации).
+
+    python -m moex_stub.record --out fixtures/moex RU000A105740 RU000A0JX0J6
+    python -m moex_stub.record --out fixtures/moex --from-file isins.txt
+"""
+import argparse
+import asyncio
+import json
+import logging
+from pathlib import Path
+
+import httpx
+
+logger = logging.getLogger("moex_stub.record")
+
+ISS_URL = "https://iss.moex.com/iss"
+BONDIZATION_TABLES = ("amortizations", "coupons", "offers")
+PAGE_LIMIT = 100
+
+
+async def record_bondization(client: httpx.AsyncClient, isin: str) -> dict:
+    """Все строки таблиц bondization.json, собранные по курсору."""
+    result = {}
+    for table in BONDIZATION_TABLES:
+        rows, columns, start, total = [], [], 0, None
+        while total is None or start < total:
+            response = await client.get(f"/securities/{isin}/bondization.json", params={
+                "iss.meta": "off", "iss.only": f"{table},{table}.cursor", "limit": PAGE_LIMIT, "start": start,
+            })
+            response.raise_for_status()
+            data = response.json()
+            columns = data[table]["columns"]
+            page = data[table]["data"]
+            rows.extend(page)
+            cursor = dict(zip(data[f"{table}.cursor"]["columns"], data[f"{table}.cursor"]["data"][0]))
+            total = cursor["TOTAL"]
+            if not page:
+                break
+            start += len(page)
+        result[table] = {"columns": columns, "data": rows}
+    return result
+
+
+async def record(isins: list[str], out: Path, concurrency: int):
+    (out / "securities").mkdir(parents=True, exist_ok=True)
+    (out / "bondization").mkdir(parents=True, exist_ok=True)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(base_url=ISS_URL, timeout=30) as client:
+        async def record_one(isin: str):
+            async with semaphore:
+                try:
+                    response = await client.get(f"/securities/{isin}.json", params={"iss.meta": "off"})
+                    response.raise_for_status()
+                    securities = response.json()
+                    bondization = await record_bondization(client, isin)
+                except httpx.HTTPError as e:
+                    logger.error(f"❌ {isin}: {e}")
+                    return
+            (out / "securities" / f"{isin}.json").write_text(
+                json.dumps(securities, ensure_ascii=False), encoding="utf-8")
+            (out / "bondization" / f"{isin}.json").write_text(
+                json.dumps(bondization, ensure_ascii=False), encoding="utf-8")
+            logger.info(f"💾 {isin}: {len(bondization['coupons']['data'])} купонов")
+
+        await asyncio.gather(*(record_one(isin) for isin in isins))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запись ответов MOEX ISS в корпус заглушки")
+    parser.add_argument("isins", nargs="*")
+    parser.add_argument("--from-file", type=Path, help="Файл со списком ISIN, по одному в строке")
+    parser.add_argument("--out", type=Path, required=True)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    isins = list(args.isins)
+    if args.from_file:
+        isins += [line.strip().upper() for line in args.from_file.read_text().splitlines() if line.strip()]
+    asyncio.run(record(isins, args.out, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+# moex_stub/server.py
+"""
+Локальная заглушка MOEX ISS для офлайн-бенчмарков и воспроизведения медленных ответов.
+
+    python -m moex_stub.server --synthetic 10000 --latency 0.05 --error-rate 0.01
+    MOEX_BASE_URL=http://127.0.0.1:8089/iss MOEX_CACHE_ENABLED=0 python manual_sync.py
+
+Отдаёт /securities/{isin}.json, /securities/{isin}/bondization.json (с курсором и
+пагинацией как в ISS) и рыночную таблицу /engines/stock/markets/bonds/securities.json.
+
+Записанные ответы MOEX в репозитории не хранятся: корпус записывается локально
+(python -m moex_stub.record --out fixtures/moex ...) и подхватывается из DEFAULT_CORPUS,
+если каталог существует. Без корпуса заглушка работает на синтетическом каталоге (--synthetic).
+"""
+import argparse
+import asyncio
+import logging
+import random
+from datetime import date
+from pathlib import Path
+
+from aiohttp import web
+
+from moex_stub.catalog import Catalog, synthetic_count
+
+logger = logging.getLogger("moex_stub")
+
+BONDIZATION_TABLES = ("amortizations", "coupons", "offers")
+DEFAULT_CORPUS = Path("fixtures/moex")
+MARKET_COLUMNS = ["SECID", "BOARDID", "SHORTNAME", "SECNAME", "ISIN", "NEXTCOUPON", "COUPONVALUE",
+                  "MATDATE", "OFFERDATE", "PUTOPTIONDATE", "FACEVALUE", "COUPONPERIOD"]
+
+
+class StubSettings:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 slow_rate: float = 0.0, slow_latency: float = 5.0,
+                 page_size: int = 20, max_page_size: int = 100, market_page_size: int = 100):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.page_size = page_size  # Как в ISS: без limit bondization отдаёт 20 строк
+        self.max_page_size = max_page_size
+        self.market_page_size = market_page_size
+
+
+def _description_value(securities: dict, name: str):
+    for row in securities.get("description", {}).get("data", []):
+        if row[0] == name:
+            return row[2]
+    return None
+
+
+def _table_rows(block: dict) -> list[dict]:
+    columns = block.get("columns", [])
+    return [dict(zip(columns, row)) for row in block.get("data", [])]
+
+
+def market_row(isin: str, securities: dict, bondization: dict, today: date) -> list:
+    """Строка рыночной таблицы, вычисленная из графика бумаги."""
+    coupons = [c for c in _table_rows(bondization.get("coupons", {})) if c["coupondate"] > today.isoformat()]
+    offers = [o for o in _table_rows(bondization.get("offers", {}))
+              if o["offerdate"] > today.isoformat() and "отмен" not in (o["offertype"] or "").lower()]
+    next_coupon = min(coupons, key=lambda c: c["coupondate"]) if coupons else None
+    values = {
+        "SECID": isin,
+        "BOARDID": "TQCB",
+        "SHORTNAME": _description_value(securities, "SHORTNAME"),
+        "SECNAME": _description_value(securities, "NAME"),
+        "ISIN": isin,
+        "NEXTCOUPON": next_coupon["coupondate"] if next_coupon else "0000-00-00",
+        "COUPONVALUE": next_coupon["value"] if next_coupon else None,
+        "MATDATE": _description_value(securities, "MATDATE") or "0000-00-00",
+        "OFFERDATE": min(o["offerdate"] for o in offers) if offers else None,
+        "PUTOPTIONDATE": None,
+        "FACEVALUE": 1000,
+        "COUPONPERIOD": 0,
+    }
+    return [values[column] for column in MARKET_COLUMNS]
+
+
+def _int_param(request: web.Request, name: str, default: int) -> int:
+    try:
+        return int(request.query.get(name, default))
+    except ValueError:
+        return default
+
+
+def _only(request: web.Request) -> set[str] | None:
+    raw = request.query.get("iss.only")
+    return {part.strip() for part in raw.split(",")} if raw else None
+
+
+@web.middleware
+async def faults_middleware(request: web.Request, handler):
+    """Задержка и ошибки по настройкам заглушки."""
+    settings: StubSettings = request.app["settings"]
+    stats = request.app["stats"]
+    stats["requests"] += 1
+
+    delay = settings.latency + random.uniform(0, settings.jitter)
+    if settings.slow_rate and random.random() < settings.slow_rate:
+        delay += settings.slow_latency
+        stats["slow"] += 1
+    if delay:
+        await asyncio.sleep(delay)
+
+    if settings.error_rate and random.random() < settings.error_rate:
+        stats["errors"] += 1
+        return web.json_response({"error": "stub failure"}, status=503)
+    return await handler(request)
+
+
+async def securities_handler(request: web.Request) -> web.Response:
+    catalog: Catalog = request.app["catalog"]
+    isin = request.match_info["isin"]
+    data = catalog.securities(isin)
+    if data is None:
+        # ISS отвечает 200 с пустыми таблицами на неизвестный код
+        data = {"description": {"columns": ["name", "title", "value"], "data": []}}
+    return web.json_response(data)
+
+
+async def bondization_handler(request: web.Request) -> web.Response:
+    catalog: Catalog = request.app["catalog"]
+    settings: StubSettings = request.app["settings"]
+    data = catalog.bondization(request.match_info["isin"]) or {}
+
+    start = max(_int_param(request, "start", 0), 0)
+    limit = min(_int_param(request, "limit", settings.page_size), settings.max_page_size)
+    only = _only(request)
+
+    response = {}
+    for table in BONDIZATION_TABLES:
+        block = data.get(table, {"columns": [], "data": []})
+        rows = block.get("data", [])
+        if only is None or table in only:
+            response[table] = {"columns": block.get("columns", []), "data": rows[start:start + limit]}
+        if only is None or f"{table}.cursor" in only:
+            response[f"{table}.cursor"] = {"columns": ["INDEX", "TOTAL", "PAGESIZE"],
+                                           "data": [[start, len(rows), limit]]}
+    return web.json_response(response)
+
+
+async def market_handler(request: web.Request) -> web.Response:
+    catalog: Catalog = request.app["catalog"]
+    settings: StubSettings = request.app["settings"]
+
+    if "market_rows" not in request.app:
+        today = date.today()
+        request.app["market_rows"] = [
+            market_row(isin, catalog.securities(isin), catalog.bondization(isin), today)
+            for isin in catalog.isins()
+        ]
+    rows = request.app["market_rows"]
+
+    start = max(_int_param(request, "start", 0), 0)
+    page = rows[start:start + settings.market_page_size] if settings.market_page_size else rows
+
+    columns = MARKET_COLUMNS
+    if requested := request.query.get("securities.columns"):
+        wanted = [c for c in requested.split(",") if c in MARKET_COLUMNS]
+        indexes = [MARKET_COLUMNS.index(c) for c in wanted]
+        columns = wanted
+        page = [[row[i] for i in indexes] for row in page]
+    return web.json_response({"securities": {"columns": columns, "data": page}})
+
+
+async def stats_handler(request: web.Request) -> web.Response:
+    return web.json_response(request.app["stats"])
+
+
+def create_app(catalog: Catalog, settings: StubSettings) -> web.Application:
+    app = web.Application(middlewares=[faults_middleware])
+    app["catalog"] = catalog
+    app["settings"] = settings
+    app["stats"] = {"requests": 0, "errors": 0, "slow": 0}
+    app.router.add_get("/iss/securities/{isin}.json", securities_handler)
+    app.router.add_get("/iss/securities/{isin}/bondization.json", bondization_handler)
+    app.router.add_get("/iss/engines/stock/markets/bonds/securities.json", market_handler)
+    app.router.add_get("/stub/stats", stats_handler)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная заглушка MOEX ISS")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--corpus", type=Path,
+                        help=f"Каталог с записанными ответами (moex_stub.record), по умолчанию {DEFAULT_CORPUS}, если есть")
+    parser.add_argument("--synthetic", type=synthetic_count, default=0, help="Количество синтетических облигаций")
+    parser.add_argument("--latency", type=float, default=0.0, help="Базовая задержка ответа, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Случайная добавка к задержке, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 503")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Доля очень медленных ответов")
+    parser.add_argument("--slow-latency", type=float, default=5.0)
+    parser.add_argument("--page-size", type=int, default=20, help="Строк bondization без параметра limit")
+    parser.add_argument("--market-page-size", type=int, default=100, help="0 — вся рыночная таблица сразу")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    corpus = args.corpus
+    if corpus is None and (DEFAULT_CORPUS / "bondization").is_dir():
+        corpus = DEFAULT_CORPUS
+    if corpus is not None and not (corpus / "bondization").is_dir():
+        parser.error(f"В {corpus} нет записанного корпуса (bondization/*.json)")
+    if corpus is None and not args.synthetic:
+        parser.error(f"Нет корпуса {DEFAULT_CORPUS}: запишите его через moex_stub.record или задайте --synthetic")
+    catalog = Catalog(corpus, args.synthetic)
+    settings = StubSettings(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+        page_size=args.page_size, market_page_size=args.market_page_size,
+    )
+    logger.info(f"🧪 Заглушка MOEX: {len(catalog.isins())} облигаций, http://{args.host}:{args.port}/iss")
+    web.run_app(create_app(catalog, settings), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,304 +1,337 @@
 # notification.py
 import logging
-from datetime import datetime, timedelta
-from typing import Optional
+from datetime import datetime, timedelta, date
+from typing import Optional, NamedTuple, AsyncIterator
 
 from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from config import TELEGRAM_TOKEN
-from database.db import get_session, BondsDatabase, User, UserNotification, UserTracking
-from telegram import Bot
+from config import NOTIFY_DIGEST, STREAM_CHUNK_SIZE
+from database.db import get_session, BondsDatabase, BondEvent, User, UserNotification, UserTracking
+from notification_outbox import OutboxItem, enqueue_outbox, wake_outbox_worker
 from telegram.ext import Application
-import asyncio
 
 
-async def check_and_notify_all(app: Application):
-    async with get_session() as session:
-        today = datetime.utcnow().date()  # Используем UTC для единообразия
-        logging.info(f"Starting check_and_notify_all for {today}")
-
-        try:
-            # Загрузка облигаций и пользователей
-            bonds = await session.scalars(select(BondsDatabase))
-            users = await session.scalars(select(User))
-
-            for bond in bonds:
-                logging.debug(f"Processing bond ISIN: {bond.isin}")
-
-                # Проверка даты погашения
-                if bond.maturity_date:
-                    maturity_within_7_days = bond.maturity_date <= today + timedelta(days=7)
-                    logging.debug(
-                        f"Maturity check: {bond.maturity_date} <= {today + timedelta(days=7)} = {maturity_within_7_days}")
-
-                    if maturity_within_7_days and bond.maturity_date > today:
-                        logging.info(f"Bond {bond.isin} maturity within 7 days")
-                        users = await session.scalars(select(User))
-                        for user in users:
-                            tracking_result = await session.execute(
-                                select(UserTracking).filter_by(user_id=user.tg_id, isin=bond.isin)
-                            )
-                            user_tracking = tracking_result.scalar()
-                            if user_tracking:
-                                logging.info(f"Notifying user {user.tg_id} about maturity")
-                                await notify_user_about_event(
-                                    app=app,
-                                    bond=bond,
-                                    user=user,
-                                    user_tracking=user_tracking,
-                                    user_id=user.tg_id,
-                                    event_type="maturity",
-                                    event_date=bond.maturity_date
-                                )
-
-                # Проверка следующего купона (асинхронная версия)
-                if bond.next_coupon_date:
-                    coupon_check = bond.next_coupon_date == today + timedelta(days=1)
-                    logging.debug(
-                        f"Coupon check: {bond.next_coupon_date} == {today + timedelta(days=1)} = {coupon_check}")
-
-                    if coupon_check:
-                        users = await session.scalars(select(User))
-                        for user in users:
-                            tracking_result = await session.execute(
-                                select(UserTracking).filter_by(user_id=user.tg_id, isin=bond.isin)
-                            )
-                            user_tracking = tracking_result.scalar()
-                            if user_tracking:
-                                logging.info(f"Notifying user {user.tg_id} about coupon")
-                                await notify_user_about_event(
-                                    app=app,
-                                    bond=bond,
-                                    user=user,
-                                    user_tracking=user_tracking,
-                                    user_id=user.tg_id,
-                                    event_type="coupon",
-                                    event_date=bond.next_coupon_date
-
-                                )
-
-                # Проверка амортизации (асинхронная версия)
-                if bond.amortization_date:
-                    amortization_check = bond.amortization_date == today + timedelta(days=1)
-                    logging.debug(
-                        f"Amortization check: {bond.amortization_date} == {today + timedelta(days=1)} = {amortization_check}")
-
-                    if amortization_check:
-                        users = await session.scalars(select(User))
-                        for user in users:
-                            tracking_result = await session.execute(
-                                select(UserTracking).filter_by(user_id=user.tg_id, isin=bond.isin)
-                            )
-                            user_tracking = tracking_result.scalar()
-                            if user_tracking:
-                                logging.info(f"Notifying user {user.tg_id} about amortization")
-                                await notify_user_about_event(
-                                    app=app,
-                                    bond=bond,
-                                    user=user,
-                                    user_tracking=user_tracking,
-                                    user_id=user.tg_id,
-                                    event_type="amortization",
-                                    event_date=bond.amortization_date,
-                                )
-                # Обработка оферты (offer)
-                if bond.offer_date:
-                    days_left = (bond.offer_date - today).days
-                    logging.debug(f"Offer check: {bond.isin} days_left={days_left}")
-                    if 1 <= days_left <= 14:
-                        logging.debug(f"Processing offer for {bond.isin}, days left: {days_left}")
-                        users = await session.scalars(select(User))
-                        for user in users:
-                            logging.debug(f"Checking user_tracking for user {user.tg_id} and bond {bond.isin}")
-                            tracking = await session.execute(
-                                select(UserTracking).filter_by(user_id=user.tg_id, isin=bond.isin)
-                            )
-                            user_tracking = tracking.scalar()
-                            if user_tracking:
-                                logging.debug(f"User {user.tg_id} is tracking {bond.isin}")
-                                await notify_user_about_event(
-                                    app=app,
-                                    bond=bond,
-                                    user=user,
-                                    user_tracking=user_tracking,
-                                    user_id=user.tg_id,
-                                    event_type="offer",
-                                    event_date=bond.offer_date,
-                                    days_left=days_left,
-                                )
-        except Exception as e:
-            logging.error(f"Critical error in check_and_notify_all: {e}", exc_info=True)
+class DueEvent(NamedTuple):
+    """Одно наступающее событие по облигации для конкретного пользователя."""
+    user_id: int
+    full_name: str
+    quantity: int
+    isin: str
+    bond_name: Optional[str]
+    event_type: str
+    event_date: date
+    amount: Optional[float]
+    days_left: Optional[int]
 
 
-async def manual_send_notifications(app: Application):
-    with get_session() as session:
-        users = session.query(User).all()  # Получаем всех пользователей
-        today = datetime.now().date()
-
-        for user in users:
-            # Логика проверки событий для каждого пользователя
-            for bond in session.query(BondsDatabase).all():
-                user_tracking = session.query(UserTracking).filter(
-                    UserTracking.user_id == user.tg_id,
-                    UserTracking.isin == bond.isin
-                ).first()
-                if user_tracking:
-                    # Проверка даты погашения, купонов и амортизации
-                    if bond.maturity_date and bond.maturity_date <= today + timedelta(days=7):
-                        await notify_user_about_event(
-                            app=app,
-                            bond=bond,  # Объект облигации
-                            user=user,  # Объект пользователя
-                            user_tracking=user_tracking,  # Объект UserTracking
-                            user_id=user.tg_id,  # ID пользователя
-                            event_type="maturity",
-                            event_date=bond.maturity_date,
-                        )
-                    if bond.next_coupon_date and bond.next_coupon_date == today + timedelta(days=1):
-                        await notify_user_about_event(
-                            app=app,
-                            bond=bond,  # Объект облигации
-                            user=user,  # Объект пользователя
-                            user_tracking=user_tracking,  # Объект UserTracking
-                            user_id=user.tg_id,  # ID пользователя
-                            event_type="coupon",
-                            event_date=bond.maturity_date,
-                        )
-                    if bond.amortization_date and bond.amortization_date == today + timedelta(days=1):
-                        await notify_user_about_event(
-                            app=app,
-                            bond=bond,  # Объект облигации
-                            user=user,  # Объект пользователя
-                            user_tracking=user_tracking,  # Объект UserTracking
-                            user_id=user.tg_id,  # ID пользователя
-                            event_type="amortization",
-                            event_date=bond.maturity_date,
-                        )
-
-
-async def async_send_notification(context):
-    user_id = context.job.data['user_id']
-    message = context.job.data['message']
-    if user_id is None or message is None:
-        logging.error(f"Invalid data for notification: user_id={user_id}, message={message}")
-        return
-    bot: Bot = context.bot
-    try:
-        await bot.send_message(chat_id=user_id, text=message)
-        logging.info(f"Notification sent to user {user_id}: {message}")
-        await asyncio.sleep(0.05)  # Небольшая задержка для соблюдения rate limits
-    except Exception as e:
-        logging.exception(f"Error sending notification to user {user_id}: {e}")
-
-
-async def notify_user_about_event(
-        app: Application,
-        bond: BondsDatabase,
-        user: User,
-        user_tracking: UserTracking,
-        user_id: int,
-        event_type: str,
-        event_date: datetime,
-        days_left: Optional[int] = None,
-):
+# asyncpg ограничивает число параметров в запросе (32767), 7 колонок на строку
+CLAIM_CHUNK_SIZE = 2000
+
+# Максимальная длина текста сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+OFFER_NOTES = (
+    "⚠️ Важные заметки:\n"
+    "• Сроки подачи заявок отличаются у разных брокеров\n"
+    "• Проверьте условия оферты в официальных документах\n"
+    "• Уточните дедлайн у вашего брокера заранее"
+)
+
+# Окна уведомлений по bond_events: тип события -> (от дней, до дней) относительно today
+EVENT_WINDOWS = {
+    "maturity": (1, 7),
+    "coupon": (1, 1),
+    "amortization": (1, 1),
+    "offer": (1, 14),
+}
+
+
+def due_events_query(event_type: str, today: date):
+    """
+    JOIN-запрос bond_events ⋈ user_tracking ⋈ users для одного типа события.
+    Диапазон по event_date идёт по индексу, стоимость зависит от числа событий, а не от каталога.
+    """
+    days_from, days_to = EVENT_WINDOWS[event_type]
+    return (
+        select(
+            UserTracking.user_id,
+            User.full_name,
+            UserTracking.quantity,
+            BondEvent.isin,
+            BondsDatabase.name,
+            BondEvent.event_date,
+            BondEvent.amount,
+        )
+        .select_from(BondEvent)
+        .join(UserTracking, UserTracking.isin == BondEvent.isin)
+        .join(User, User.tg_id == UserTracking.user_id)
+        .join(BondsDatabase, BondsDatabase.isin == BondEvent.isin)
+        .where(
+            BondEvent.event_type == event_type,
+            BondEvent.event_date.between(today + timedelta(days=days_from), today + timedelta(days=days_to)),
+        )
+    )
+
+
+async def plan_due_events(session: AsyncSession, today: date) -> AsyncIterator[DueEvent]:
+    """
+    Потоково отдаёт все (пользователь, облигация, событие, дата), по которым сегодня
+    нужно уведомление. Один запрос на тип события, без перебора всех пользователей.
+    """
+    for event_type in EVENT_WINDOWS:
+        result = await session.stream(
+            due_events_query(event_type, today).execution_options(yield_per=STREAM_CHUNK_SIZE)
+        )
+        async for row in result:
+            yield DueEvent(
+                user_id=row.user_id,
+                full_name=row.full_name,
+                quantity=row.quantity,
+                isin=row.isin,
+                bond_name=row.name,
+                event_type=event_type,
+                event_date=row.event_date,
+                amount=row.amount,
+                days_left=(row.event_date - today).days if event_type == "offer" else None,
+            )
+
+
+async def check_and_notify_all(app: Application):
+    today = datetime.utcnow().date()  # Используем UTC для единообразия
+    logging.info(f"Starting check_and_notify_all for {today}")
+
     try:
         async with get_session() as session:
-            bond_isin = bond.isin
-            logging.debug(f"Attempting to notify user {user_id} about {event_type}")
-            stmt = select(UserNotification).where(
-                UserNotification.user_id == user_id,
-                UserNotification.bond_isin == bond_isin,  # <-- Важно!
-                UserNotification.event_type == event_type,
-                UserNotification.event_date == event_date
+            # Дедупликация по ключу уведомления (бумага может отслеживаться дважды)
+            planned = {}
+            async for event in plan_due_events(session, today):
+                planned.setdefault(notification_key(event), event)
+
+            # Заявка уведомлений и запись в outbox — одна транзакция
+            claimed = await claim_notifications(session, list(planned.values()))
+            items = build_outbox_items(claimed)
+            await enqueue_outbox(session, items)
+            await session.commit()
+
+        wake_outbox_worker()
+        logging.info(
+            f"check_and_notify_all finished: {len(planned)} due events, "
+            f"{len(claimed)} new notifications claimed, {len(items)} messages queued in outbox"
+        )
+    except Exception as e:
+        logging.error(f"Critical error in check_and_notify_all: {e}", exc_info=True)
+
+
+async def manual_send_notifications(app: Application):
+    """Ручной запуск рассылки — тот же планировщик, что и в ежедневной задаче."""
+    await check_and_notify_all(app)
+
+
+def get_days_word(d: int) -> str:
+    if 11 <= d <= 14:
+        return "дней"
+    last = d % 10
+    return {1: "день", 2: "дня", 3: "дня", 4: "дня"}.get(last, "дней")
+
+
+def build_event_message(event: DueEvent) -> str:
+    """Формирует текст уведомления с учетом типа события."""
+    name = event.bond_name
+    date_str = event.event_date.strftime('%d.%m.%Y')
+    quantity = event.quantity or 0
+
+    if event.event_type == "coupon":
+        total = (event.amount or 0) * quantity
+        return (
+            f"Привет! {event.full_name}, по вашей облигации {name} (ISIN: {event.isin})\n"
+            f"📅 Выплата купона {date_str}\n"
+            f"💰 Сумма к получению: {total:.2f} руб."
+        )
+
+    if event.event_type == "maturity":
+        return (
+            f"Привет! {event.full_name}, облигация {name} (ISIN: {event.isin})\n"
+            f"🏁 Погашение {date_str}\n"
+            "Рекомендуем подготовиться к получению номинала."
+        )
+
+    if event.event_type == "amortization":
+        total = (event.amount or 0) * quantity
+        return (
+            f"Привет! {event.full_name}, по вашей облигации {name} (ISIN: {event.isin})\n"
+            f"📉 Частичное погашение {date_str}\n"
+            f"💰 Сумма к получению: {total:.2f} руб."
+        )
+
+    if event.event_type == "offer":
+        if event.days_left is None:
+            logging.error("Days_left is None for offer event!")
+            return ""
+        days_word = get_days_word(event.days_left) if event.days_left else "дней"
+        return (
+            f"Привет! {event.full_name}, по вашей облигации {name} (ISIN: {event.isin})\n"
+            f"⏳ До оферты осталось {event.days_left} {days_word} ({date_str})\n\n"
+            + OFFER_NOTES
+        )
+
+    return ""
+
+
+def event_total(event: DueEvent) -> float:
+    """Сумма к получению по событию (купон/амортизация), иначе 0."""
+    if event.event_type in ("coupon", "amortization"):
+        return (event.amount or 0) * (event.quantity or 0)
+    return 0.0
+
+
+def build_digest_item(event: DueEvent) -> str:
+    date_str = event.event_date.strftime('%d.%m.%Y')
+    title = f"• {event.bond_name} (ISIN: {event.isin})\n"
+    if event.event_type == "coupon":
+        return title + f"  📅 Выплата купона {date_str} — {event_total(event):.2f} руб."
+    if event.event_type == "amortization":
+        return title + f"  📉 Частичное погашение {date_str} — {event_total(event):.2f} руб."
+    if event.event_type == "maturity":
+        return title + f"  🏁 Погашение {date_str}"
+    if event.event_type == "offer":
+        days_word = get_days_word(event.days_left) if event.days_left else "дней"
+        return title + f"  ⏳ Оферта через {event.days_left} {days_word} ({date_str})"
+    return ""
+
+
+def build_digest_messages(events: list[DueEvent]) -> list[tuple[str, list[DueEvent]]]:
+    """
+    Собирает все события пользователя в одно сообщение (или несколько,
+    если текст не помещается в лимит Telegram). Итог считается по пользователю.
+    Место под итог резервируется в каждом сообщении: события, которые не помещаются,
+    переносятся в следующее, а текст не обрезается.
+    Возвращает пары (текст, события, вошедшие в это сообщение).
+    """
+    events = sorted(events, key=lambda e: (e.event_date, e.event_type, e.isin))
+    header = f"Привет! {events[0].full_name}, события по вашим облигациям:\n\n"
+
+    footer_parts = []
+    total = sum(event_total(e) for e in events)
+    if total:
+        footer_parts.append(f"💰 Итого к получению: {total:.2f} руб.")
+    if any(e.event_type == "offer" for e in events):
+        footer_parts.append(OFFER_NOTES)
+    footer = "\n\n" + "\n\n".join(footer_parts) if footer_parts else ""
+
+    # Текст событий одного сообщения без завершающих переводов строки
+    budget = TELEGRAM_MESSAGE_LIMIT - len(footer)
+
+    messages = []
+    current, included = header, []
+    for event in events:
+        item = build_digest_item(event)
+        if not item:
+            continue
+        if len(current) + len(item) > budget and included:
+            messages.append((current.rstrip(), included))
+            current, included = header, []
+        # Одиночная строка длиннее сообщения — только её и укорачиваем
+        current += item[:budget - len(current)] + "\n\n"
+        included.append(event)
+
+    messages.append((current.rstrip() + footer, included))
+    return messages
+
+
+def group_by_user(events: list[DueEvent]) -> dict[int, list[DueEvent]]:
+    grouped = {}
+    for event in events:
+        grouped.setdefault(event.user_id, []).append(event)
+    return grouped
+
+
+def notification_key(event: DueEvent) -> tuple:
+    return event.user_id, event.isin, event.event_type, event.event_date
+
+
+async def claim_notifications(session: AsyncSession, events: list[DueEvent]) -> dict[int, DueEvent]:
+    """
+    Пакетно записывает уведомления одним INSERT ... ON CONFLICT DO NOTHING RETURNING.
+    Возвращает {id уведомления: событие} только для событий, заявленных этим вызовом,
+    поэтому параллельные запуски не отправят одно и то же дважды.
+    Коммит делает вызывающий код, вместе с записью в outbox.
+    """
+    if not events:
+        return {}
+
+    by_key = {notification_key(e): e for e in events}
+    claimed = {}
+    keys = list(by_key)
+    for i in range(0, len(keys), CLAIM_CHUNK_SIZE):
+        chunk = keys[i:i + CLAIM_CHUNK_SIZE]
+        stmt = (
+            pg_insert(UserNotification)
+            .values([
+                {
+                    "user_id": by_key[key].user_id,
+                    "bond_isin": by_key[key].isin,
+                    "event_type": by_key[key].event_type,
+                    "event_date": by_key[key].event_date,
+                    "is_sent": False,
+                    "days_left": by_key[key].days_left,
+                }
+                for key in chunk
+            ])
+            .on_conflict_do_nothing(
+                index_elements=["user_id", "bond_isin", "event_type", "event_date"]
+            )
+            .returning(
+                UserNotification.id,
+                UserNotification.user_id,
+                UserNotification.bond_isin,
+                UserNotification.event_type,
+                UserNotification.event_date,
             )
-            result = await session.execute(stmt)
-            notification = result.scalar_one_or_none()
-
-            if not notification:
-                message = ""
-                quantity = user_tracking.quantity if user_tracking else 0
-
-                # Формирование сообщения с учетом типа события
-                if event_type == "coupon":
-                    coupon_value = bond.next_coupon_value or 0
-                    total = coupon_value * quantity
-                    message = (
-                        f"Привет! {user.full_name}, по вашей облигации {bond.name} (ISIN: {bond_isin})\n"
-                        f"📅 Выплата купона {event_date.strftime('%d.%m.%Y')}\n"
-                        f"💰 Сумма к получению: {total:.2f} руб."
-                    )
-
-                elif event_type == "maturity":
-                    message = (
-                        f"Привет! {user.full_name}, облигация {bond.name} (ISIN: {bond_isin})\n"
-                        f"🏁 Погашение {event_date.strftime('%d.%m.%Y')}\n"
-                        "Рекомендуем подготовиться к получению номинала."
-                    )
-
-                elif event_type == "amortization":
-                    amort_value = bond.amortization_value or 0
-                    total = amort_value * quantity
-                    message = (
-                        f"Привет! {user.full_name}, по вашей облигации {bond.name} (ISIN: {bond_isin})\n"
-                        f"📉 Частичное погашение {event_date.strftime('%d.%m.%Y')}\n"
-                        f"💰 Сумма к получению: {total:.2f} руб."
-                    )
-
-                elif event_type == "offer":
-                    logging.debug(f"Forming offer message. Days left: {days_left}")
-                    # Добавьте проверку days_left
-                    if days_left is None:
-                        logging.error("Days_left is None for offer event!")
-                        return
-
-                    def get_days_word(d: int) -> str:
-                        # Добавьте логирование
-                        try:
-                            if 11 <= d <= 14:
-                                return "дней"
-                            last = d % 10
-                            return {1: "день", 2: "дня", 3: "дня", 4: "дня"}.get(last, "дней")
-                        except Exception as e:
-                            logging.error(f"Error in get_days_word: {e}")
-                            return "дней"
-
-                    days_word = get_days_word(days_left) if days_left else "дней"
-                    message = (
-                        f"Привет! {user.full_name}, по вашей облигации {bond.name} (ISIN: {bond_isin})\n"
-                        f"⏳ До оферты осталось {days_left} {days_word} ({event_date.strftime('%d.%m.%Y')})\n\n"
-                        "⚠️ Важные заметки:\n"
-                        "• Сроки подачи заявок отличаются у разных брокеров\n"
-                        "• Проверьте условия оферты в официальных документах\n"
-                        "• Уточните дедлайн у вашего брокера заранее"
-                    )
-                    logging.debug(f"Message for offer: {message}")
-                # Отправка сообщения через JobQueue
+        )
+        result = await session.execute(stmt)
+        for row in result:
+            event_date = row.event_date.date() if isinstance(row.event_date, datetime) else row.event_date
+            claimed[row.id] = by_key[(row.user_id, row.bond_isin, row.event_type, event_date)]
+
+    return claimed
+
+
+def build_outbox_items(claimed: dict[int, DueEvent]) -> list[OutboxItem]:
+    """Превращает заявленные события в сообщения для outbox (дайджест или по одному)."""
+    items = []
+    if NOTIFY_DIGEST:
+        ids_by_key = {notification_key(event): notification_id for notification_id, event in claimed.items()}
+        for user_id, user_events in group_by_user(list(claimed.values())).items():
+            if len(user_events) == 1:
+                message = build_event_message(user_events[0])
                 if message:
-                    app.job_queue.run_once(
-                        async_send_notification,
-                        when=0,
-                        data={'user_id': user_id, 'message': message}
-
-                    )
-                    logging.debug(f"Scheduled job for user {user_id}")
-                # Сохранение уведомления в БД
-                new_notification = UserNotification(
-                    user_id=user_id,
-                    bond_isin=bond_isin,
-                    event_type=event_type,
-                    event_date=event_date,
-                    is_sent=True,
-                    sent_at=datetime.utcnow(),
-                    days_left=days_left
-                )
-                session.add(new_notification)
-                await session.commit()
-                logging.info(f"Уведомление для {user_id} ({event_type}) запланировано")
-
-            else:
-                logging.info(f"Уведомление уже существует: {user_id} {bond_isin} {event_type}")
+                    items.append(OutboxItem(user_id, message, [ids_by_key[notification_key(user_events[0])]]))
+                continue
+            for message, included in build_digest_messages(user_events):
+                items.append(OutboxItem(user_id, message, [ids_by_key[notification_key(e)] for e in included]))
+    else:
+        for notification_id, event in claimed.items():
+            message = build_event_message(event)
+            if message:
+                items.append(OutboxItem(event.user_id, message, [notification_id]))
+    return items
 
+
+async def notify_user_about_event(app: Application, event: DueEvent):
+    """Одиночный путь: заявляет уведомление и кладёт сообщение в outbox, если оно новое."""
+    try:
+        async with get_session() as session:
+            claimed = await claim_notifications(session, [event])
+            if not claimed:
+                logging.info(f"Уведомление уже существует: {event.user_id} {event.isin} {event.event_type}")
+                return
+            message = build_event_message(event)
+            if message:
+                await enqueue_outbox(session, [OutboxItem(event.user_id, message, list(claimed))])
+            await session.commit()
+        wake_outbox_worker()
+        logging.info(f"Уведомление для {event.user_id} ({event.event_type}) запланировано")
     except Exception as e:
         logging.error(f"Ошибка в notify_user_about_event: {e}", exc_info=True)
-        if 'session' in locals():
-            await session.rollback()
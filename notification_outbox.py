@@ -0,0 +1,219 @@
+# notification_outbox.py
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select, update, insert, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from telegram.error import Forbidden, BadRequest
+from telegram.ext import Application
+
+from bot.send_dispatcher import get_send_dispatcher
+from config import (
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_LEASE_SECONDS,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_BACKOFF_BASE_SECONDS,
+)
+from database.db import get_session, NotificationOutbox, UserNotification
+
+logger = logging.getLogger("notification_outbox")
+
+_wakeup: Optional[asyncio.Event] = None
+
+
+class OutboxItem(NamedTuple):
+    """Сообщение для outbox и уведомления, которые оно доставляет."""
+    user_id: int
+    message: str
+    notification_ids: list[int]
+
+
+async def enqueue_outbox(session: AsyncSession, items: list[OutboxItem]):
+    """
+    Массово добавляет сообщения в outbox и связывает с ними уведомления.
+    Коммит делает вызывающий код — в той же транзакции, где уведомления заявлены.
+    """
+    if not items:
+        return
+
+    now = datetime.utcnow()
+    result = await session.execute(
+        insert(NotificationOutbox).returning(NotificationOutbox.id, sort_by_parameter_order=True),
+        [
+            {"user_id": item.user_id, "message": item.message, "status": "pending",
+             "attempts": 0, "next_attempt_at": now, "created_at": now}
+            for item in items
+        ],
+    )
+    outbox_ids = result.scalars().all()
+
+    links = [
+        {"id": notification_id, "outbox_id": outbox_id}
+        for item, outbox_id in zip(items, outbox_ids)
+        for notification_id in item.notification_ids
+    ]
+    if links:
+        await session.execute(update(UserNotification), links)
+
+
+async def claim_outbox_batch(session: AsyncSession, limit: int) -> list:
+    """
+    Забирает пачку готовых к отправке сообщений (FOR UPDATE SKIP LOCKED) и
+    переводит их в sending с арендой: если процесс упадёт, после OUTBOX_LEASE_SECONDS
+    сообщения снова станут доступны. Несколько воркеров не заберут одно и то же.
+    """
+    now = datetime.utcnow()
+    due = (
+        select(NotificationOutbox.id)
+        .where(
+            NotificationOutbox.status.in_(("pending", "sending")),
+            NotificationOutbox.next_attempt_at <= now,
+        )
+        .order_by(NotificationOutbox.next_attempt_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    result = await session.execute(
+        update(NotificationOutbox)
+        .where(NotificationOutbox.id.in_(due.scalar_subquery()))
+        .values(status="sending", next_attempt_at=now + timedelta(seconds=OUTBOX_LEASE_SECONDS))
+        .returning(
+            NotificationOutbox.id,
+            NotificationOutbox.user_id,
+            NotificationOutbox.message,
+            NotificationOutbox.attempts,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return result.all()
+
+
+async def mark_delivered(session: AsyncSession, outbox_ids: list[int], now: datetime):
+    if not outbox_ids:
+        return
+    await session.execute(
+        update(NotificationOutbox)
+        .where(NotificationOutbox.id.in_(outbox_ids))
+        .values(status="sent", sent_at=now, last_error=None)
+        .execution_options(synchronize_session=False)
+    )
+    await session.execute(
+        update(UserNotification)
+        .where(UserNotification.outbox_id.in_(outbox_ids))
+        .values(is_sent=True, sent_at=now)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def release_lease(session: AsyncSession, outbox_ids: list[int], now: datetime):
+    """
+    Отправка отменена (диспетчер остановлен при завершении процесса): сообщение возвращается
+    в pending без расхода попытки и будет отправлено при следующем разборе outbox.
+    """
+    if not outbox_ids:
+        return
+    await session.execute(
+        update(NotificationOutbox)
+        .where(NotificationOutbox.id.in_(outbox_ids))
+        .values(status="pending", next_attempt_at=now)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def is_permanent_error(error: BaseException) -> bool:
+    """Пользователь заблокировал бота или запрос некорректен — повтор не поможет."""
+    return isinstance(error, (Forbidden, BadRequest))
+
+
+async def mark_failed(session: AsyncSession, failures: list[tuple], now: datetime):
+    """
+    Неудачные сообщения (строка outbox, ошибка): постоянные ошибки сразу помечаются failed,
+    временные откладываются с экспоненциальной задержкой до OUTBOX_MAX_ATTEMPTS попыток.
+    У окончательно неудачных снимаются заявки user_notifications, чтобы следующий запуск
+    планировщика мог заново запланировать эти события.
+    """
+    if not failures:
+        return
+    params = []
+    for row, error in failures:
+        attempts = row.attempts + 1
+        permanent = is_permanent_error(error)
+        params.append({
+            "id": row.id,
+            "attempts": attempts,
+            "status": "failed" if permanent or attempts >= OUTBOX_MAX_ATTEMPTS else "pending",
+            "next_attempt_at": now + timedelta(seconds=OUTBOX_BACKOFF_BASE_SECONDS * 2 ** row.attempts),
+            "last_error": f"{type(error).__name__}: {error}",
+        })
+    await session.execute(update(NotificationOutbox), params)
+
+    given_up = [item["id"] for item in params if item["status"] == "failed"]
+    if given_up:
+        await session.execute(
+            delete(UserNotification)
+            .where(UserNotification.outbox_id.in_(given_up))
+            .execution_options(synchronize_session=False)
+        )
+        logger.warning(f"Outbox: {len(given_up)} сообщений не доставлено, заявки на события сняты")
+
+
+async def drain_outbox_batch(app: Application) -> int:
+    """Отправляет одну пачку из outbox. Возвращает количество обработанных сообщений."""
+    async with get_session() as session:
+        rows = await claim_outbox_batch(session, OUTBOX_BATCH_SIZE)
+        await session.commit()
+
+    if not rows:
+        return 0
+
+    dispatcher = get_send_dispatcher(app)
+    results = await asyncio.gather(
+        *(dispatcher.submit(row.user_id, row.message) for row in rows),
+        return_exceptions=True,
+    )
+    delivered = [row.id for row, result in zip(rows, results) if result is True]
+    # Отмена — не ошибка отправки: попытка не засчитывается
+    cancelled = [row.id for row, result in zip(rows, results) if isinstance(result, asyncio.CancelledError)]
+    failed = [(row, result) for row, result in zip(rows, results)
+              if result is not True and not isinstance(result, asyncio.CancelledError)]
+
+    now = datetime.utcnow()
+    async with get_session() as session:
+        await mark_delivered(session, delivered, now)
+        await mark_failed(session, failed, now)
+        await release_lease(session, cancelled, now)
+        await session.commit()
+
+    logger.info(f"Outbox batch: {len(delivered)} delivered, {len(failed)} failed, {len(cancelled)} cancelled")
+    return len(rows)
+
+
+def wake_outbox_worker():
+    """Будит воркер сразу после пополнения outbox, не дожидаясь интервала опроса."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def run_outbox_worker(app: Application):
+    """Фоновый воркер: разбирает outbox, пока процесс работает."""
+    global _wakeup
+    _wakeup = asyncio.Event()
+    logger.info("Outbox worker started")
+
+    while True:
+        _wakeup.clear()
+        try:
+            processed = await drain_outbox_batch(app)
+        except Exception as e:
+            logger.error(f"Ошибка воркера outbox: {e}", exc_info=True)
+            processed = 0
+
+        if processed:
+            continue
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass